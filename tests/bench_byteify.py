@@ -0,0 +1,70 @@
+"""byteify micro-benchmark
+
+Times the previous recursive byteify against the iterative one on the
+fixture contract and on a batch of renamed copies, plus json parsing
+followed by byteify against byteify_loads. Prints a JSON report with the
+best time per call in microseconds.
+
+    python bench_byteify.py --count 1000
+"""
+import os
+import sys
+import copy
+import json
+import timeit
+import argparse
+
+from utils import byteify, byteify_loads, rename_contract
+
+
+def byteify_recursive(input):
+    if isinstance(input, dict):
+        return {byteify_recursive(key):byteify_recursive(value) for key,value in input.iteritems()}
+    elif isinstance(input, list):
+        return [byteify_recursive(element) for element in input]
+    elif isinstance(input, unicode):
+        return input.encode('utf-8')
+    else:
+        return input
+
+
+def best(function, repeat, number):
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='byteify micro-benchmark')
+    parser.add_argument('--count', type=int, default=1000, help='Contracts in the batch payload')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with open(os.path.join('data', 'test_new_contract1.json')) as f:
+        contract = json.load(f)
+    batch = [rename_contract(copy.deepcopy(contract), 'BENCH{0:06d}'.format(n))
+             for n in range(args.count)]
+    payloads = {
+        'contract': contract,
+        'batch': batch,
+        'contract_bytes': byteify(contract),
+        'batch_bytes': byteify(batch),
+    }
+    assert byteify(batch) == byteify_recursive(batch)
+
+    report = {}
+    for name, payload in sorted(payloads.iteritems()):
+        number = max(1, 10000 // len(json.dumps(payload)) * 10)
+        report[name] = {
+            'recursive_us': best(lambda: byteify_recursive(payload), args.repeat, number),
+            'iterative_us': best(lambda: byteify(payload), args.repeat, number),
+        }
+    for name in ['contract', 'batch']:
+        content = json.dumps(payloads[name])
+        number = max(1, 10000 // len(content) * 10)
+        report[name].update({
+            'loads_then_byteify_us': best(lambda: byteify(json.loads(content)), args.repeat, number),
+            'byteify_loads_us': best(lambda: byteify_loads(content), args.repeat, number),
+        })
+    print json.dumps(report, indent=4, sort_keys=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
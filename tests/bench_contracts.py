@@ -0,0 +1,168 @@
+"""Contract throughput benchmark
+
+Clones data/test_new_contract1.json into --count contracts and drives
+add_contract, get_contract, update_contract and delete_contract over them
+with --concurrency workers. The bulk operation posts the contracts in
+lists of --batch-size instead, delete them before posting them again.
+Prints a JSON report with ops/s, contracts/s and latency percentiles (ms)
+per operation, and how long the fixtures took to load. With --corpus the
+contracts are read from a corpus.py file instead, fastest in its marshal
+format.
+
+    python bench_contracts.py --count 500 --concurrency 16 --standin
+    python bench_contracts.py --operations add,delete,bulk,delete --batch-size 50
+    python bench_contracts.py --count 10000 --corpus corpus.marshal --operations bulk,delete
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+from multiprocessing.pool import ThreadPool
+
+from utils import rename_contract, percentiles, setup_empowering
+from fixtures import setup_fixtures
+from session import setup_session
+from bulk import BulkUploader, chunks
+
+OPERATIONS = ['add', 'get', 'update', 'delete']
+BATCH_OPERATIONS = ['bulk']
+
+
+def make_contracts(filename, count, prefix):
+    fixtures = setup_fixtures()
+    contracts = []
+    for n in range(count):
+        contract = fixtures.contract(filename)
+        rename_contract(contract.root, '{0}{1:06d}'.format(prefix, n))
+        contracts.append(contract)
+    return contracts
+
+
+def corpus_contracts(filename, count, prefix):
+    contracts = []
+    for n, contract in enumerate(setup_fixtures().corpus(filename, count)):
+        rename_contract(contract.root, '{0}{1:06d}'.format(prefix, n))
+        contracts.append(contract)
+    return contracts
+
+
+class ContractBenchmark(object):
+    def __init__(self, client, contracts, updates, concurrency, batch_size=50):
+        self.client = client
+        self.contracts = contracts
+        self.updates = updates
+        self.batches = list(chunks(contracts, batch_size))
+        self.uploader = BulkUploader(setup_session(), batch_size)
+        self.etags = {}
+        self.pool = ThreadPool(concurrency)
+
+    def add(self, contract):
+        result = self.client.add_contract(contract.dump())
+        self.etags[result['contractId']] = result['_etag']
+
+    def get(self, contract):
+        result = self.client.get_contract(contract.root['contractId'])
+        self.etags[result['contractId']] = result['_etag']
+
+    def update(self, contract):
+        contract_id = contract.root['contractId']
+        update = self.updates[contract_id]
+        result = self.client.update_contract(contract_id, self.etags[contract_id], update.dump())
+        self.etags[contract_id] = result['_etag']
+
+    def delete(self, contract):
+        contract_id = contract.root['contractId']
+        self.client.delete_contract(contract_id, self.etags.pop(contract_id))
+
+    def bulk(self, batch):
+        for item in self.uploader.submit([contract.dump() for contract in batch]):
+            if item['_status'] != 'OK':
+                raise Exception('Bulk item failed: {0}'.format(item))
+            self.etags[item['contractId']] = item['_etag']
+
+    def run(self, operation):
+        call = getattr(self, operation)
+
+        def timed(item):
+            start = time.time()
+            try:
+                call(item)
+                return time.time() - start, None
+            except Exception, e:
+                return time.time() - start, repr(e)
+
+        start = time.time()
+        results = self.pool.map(timed, self.batches if operation in BATCH_OPERATIONS
+                                else self.contracts)
+        elapsed = time.time() - start
+        latencies = [latency * 1000 for latency, error in results]
+        errors = [error for latency, error in results if error]
+        return {
+            'ops': len(results),
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+            'seconds': elapsed,
+            'ops_per_second': len(results) / elapsed if elapsed else None,
+            'contracts_per_second': len(self.contracts) / elapsed if elapsed else None,
+            'latency_ms': percentiles(latencies),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Empowering contract throughput benchmark')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--operations', default=','.join(OPERATIONS))
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help='Contracts per request of the bulk operation')
+    parser.add_argument('--prefix', default='BENCH')
+    parser.add_argument('--corpus', default=None,
+                        help='Read the contracts from this corpus file (.jsonl or .marshal)')
+    parser.add_argument('--standin', action='store_true',
+                        help='Run against the local stand-in instead of EMPOWERING_URL')
+    parser.add_argument('--latency', default=None,
+                        help='Stand-in latency as <seconds>[,<jitter>]')
+    parser.add_argument('--output', default=None, help='Write the report to this file')
+    args = parser.parse_args(argv)
+
+    if args.standin:
+        os.environ['EMPOWERING_STANDIN'] = '1'
+    if args.latency:
+        os.environ['EMPOWERING_STANDIN_LATENCY'] = args.latency
+    os.environ['EMPOWERING_CONCURRENCY'] = str(args.concurrency)
+    client = setup_empowering()
+
+    start = time.time()
+    if args.corpus:
+        contracts = corpus_contracts(args.corpus, args.count, args.prefix)
+    else:
+        contracts = make_contracts('test_new_contract1.json', args.count, args.prefix)
+    updates = {contract.root['contractId']: contract
+               for contract in make_contracts('test_update_contract1.json',
+                                              len(contracts), args.prefix)}
+    fixtures = dict(setup_fixtures().stats(), load_seconds=round(time.time() - start, 6),
+                    source=args.corpus or 'data')
+    benchmark = ContractBenchmark(client, contracts, updates, args.concurrency, args.batch_size)
+
+    report = {
+        'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'url': os.getenv('EMPOWERING_URL'),
+        'count': len(contracts),
+        'concurrency': args.concurrency,
+        'batch_size': args.batch_size,
+        'fixtures': fixtures,
+        'operations': {},
+    }
+    for operation in args.operations.split(','):
+        report['operations'][operation] = benchmark.run(operation)
+
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print output
+
+if __name__ == '__main__':
+    sys.exit(main())
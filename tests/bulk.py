@@ -0,0 +1,119 @@
+import time
+import json
+import itertools
+
+import requests
+
+TRANSIENT_STATUS = [429, 500, 502, 503, 504]
+
+
+class BulkError(Exception):
+    pass
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class BulkUploader(object):
+    """Posts contracts as Eve list payloads of up to `batch_size` documents
+
+    Eve inserts a list atomically: when an item is rejected, every item
+    comes back with its own _status and nothing is stored. The items with
+    _issues are final, the rest are posted again on their own. Connection
+    errors and 5xx answers retry the pending items up to `retries` times.
+    With a `validator`, invalid contracts are rejected without a request.
+    """
+    def __init__(self, session, batch_size=50, retries=3, validator=None, backoff=0.5):
+        self.session = session
+        self.url = session.endpoint('contracts')
+        self.batch_size = batch_size
+        self.retries = retries
+        self.validator = validator
+        self.backoff = backoff
+        self.requests = 0
+        self.created = 0
+        self.rejected = 0
+        self.retried = 0
+
+    def _post(self, documents):
+        self.requests += 1
+        response = self.session.post(self.url, data=json.dumps(documents),
+                                     headers={'Content-Type': 'application/json'})
+        if response.status_code in TRANSIENT_STATUS:
+            raise BulkError('{0} {1}'.format(response.status_code, response.reason))
+        if response.status_code not in (201, 422):
+            response.raise_for_status()
+        items = response.json().get('_items')
+        if not isinstance(items, list) or len(items) != len(documents):
+            raise BulkError('{0} items answered for {1} documents'.format(
+                len(items or []), len(documents)))
+        return response.status_code, items
+
+    def submit(self, documents):
+        """Server items for `documents`, in the same order
+        """
+        results = [None] * len(documents)
+        pending = range(len(documents))
+        error = None
+        attempt = 0
+        while pending and attempt < self.retries:
+            try:
+                status, items = self._post([documents[i] for i in pending])
+            except (BulkError, requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout), e:
+                error = e
+                attempt += 1
+                self.retried += len(pending)
+                time.sleep(self.backoff * attempt)
+                continue
+            if status == 201:
+                for i, item in zip(pending, items):
+                    results[i] = item
+                pending = []
+                break
+            retry = []
+            for i, item in zip(pending, items):
+                if item.get('_status') == 'OK':
+                    retry.append(i)
+                else:
+                    results[i] = item
+            if len(retry) == len(pending):
+                error = BulkError('Batch rejected without item issues')
+                attempt += 1
+            pending = retry
+        for i in pending:
+            results[i] = {'_status': 'ERR', '_error': {'message': str(error)}}
+        return results
+
+    def upload(self, documents):
+        """(document, server item) for every document of the stream, in order
+        """
+        for batch in chunks(documents, self.batch_size):
+            results = [None] * len(batch)
+            send = range(len(batch))
+            if self.validator:
+                send = []
+                for i, issues in enumerate(self.validator.validate_many(batch)):
+                    if issues:
+                        results[i] = {'_status': 'ERR', '_issues': issues}
+                    else:
+                        send.append(i)
+            if send:
+                for i, item in zip(send, self.submit([batch[i] for i in send])):
+                    results[i] = item
+            for document, item in zip(batch, results):
+                if item.get('_status') == 'OK':
+                    self.created += 1
+                else:
+                    self.rejected += 1
+                yield document, item
+
+    def stats(self):
+        return {'requests': self.requests, 'created': self.created,
+                'rejected': self.rejected, 'retried': self.retried}
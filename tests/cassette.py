@@ -0,0 +1,191 @@
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import atexit
+import datetime
+import hashlib
+import threading
+import urlparse
+from collections import defaultdict, deque
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+__CASSETTE = None
+
+# The suites write dates as datetime.now() + timedelta in this format
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$')
+VOLATILE_DAYS = 366
+
+SKIPPED_HEADERS = ['date', 'server', 'connection', 'keep-alive', 'transfer-encoding',
+                   'content-encoding']
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+def _mask_dates(tree, now):
+    # Dates within VOLATILE_DAYS of the run, like now + 15 days, stand for
+    # their offset in days so they match whenever the run is replayed
+    if isinstance(tree, dict):
+        return {key: _mask_dates(value, now) for key, value in tree.iteritems()}
+    if isinstance(tree, list):
+        return [_mask_dates(value, now) for value in tree]
+    if isinstance(tree, basestring) and DATE_PATTERN.match(tree):
+        try:
+            date = datetime.datetime.strptime(tree, DATE_FORMAT)
+        except ValueError:
+            return tree
+        days = int(round((date - now).total_seconds() / 86400))
+        if abs(days) <= VOLATILE_DAYS:
+            return '<now{0:+d}d>'.format(days)
+    return tree
+
+
+def body_hash(body, now=None):
+    """sha1 of a request body, JSON bodies hashed in canonical form with the
+    dates near `now` as offsets
+    """
+    if not body:
+        return ''
+    try:
+        tree = _mask_dates(json.loads(body), now or datetime.datetime.now())
+        body = json.dumps(tree, sort_keys=True, separators=(',', ':'))
+    except ValueError:
+        pass
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    return hashlib.sha1(body).hexdigest()
+
+
+def request_key(method, url, body):
+    parts = urlparse.urlsplit(url)
+    query = '&'.join(sorted(parts.query.split('&'))) if parts.query else ''
+    path = parts.path.rstrip('/') + ('?' + query if query else '')
+    return '{0} {1} {2}'.format(method.upper(), path, body_hash(body))
+
+
+class Cassette(BaseAdapter):
+    """requests adapter recording or replaying the HTTP exchanges of a run
+
+    Exchanges are stored as gzipped JSON lines, indexed by method, path and
+    request body hash. Dates in the body less than VOLATILE_DAYS away from
+    the run are hashed as their offset from it. Repeated requests with the same key, like the GETs
+    of a contract along its _etag chain, replay in recorded order; once
+    exhausted the last one is served again. `latency` is 'zero' or
+    'recorded', which sleeps as long as the server took.
+    """
+    def __init__(self, filename, mode='replay', latency='zero'):
+        BaseAdapter.__init__(self)
+        if mode not in ('record', 'replay'):
+            raise ValueError('Unknown cassette mode {0}'.format(mode))
+        if latency not in ('zero', 'recorded'):
+            raise ValueError('Unknown cassette latency {0}'.format(latency))
+        self.filename = filename
+        self.mode = mode
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.exchanges = []
+        self.index = defaultdict(deque)
+        self.hits = 0
+        self.misses = 0
+        if mode == 'record':
+            self.real = HTTPAdapter()
+        else:
+            self.load()
+
+    def load(self):
+        with gzip.open(self.filename, 'rb') as f:
+            for line in f:
+                exchange = json.loads(line)
+                self.exchanges.append(exchange)
+                self.index[exchange['key']].append(exchange)
+
+    def save(self):
+        with self.lock:
+            exchanges = list(self.exchanges)
+        with gzip.open(self.filename, 'wb') as f:
+            for exchange in exchanges:
+                f.write(json.dumps(exchange, sort_keys=True, separators=(',', ':')))
+                f.write('\n')
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url, request.body)
+        if self.mode == 'record':
+            return self._record(key, request, **kwargs)
+        return self._replay(key, request)
+
+    def _record(self, key, request, **kwargs):
+        start = time.time()
+        response = self.real.send(request, **kwargs)
+        content = response.content
+        exchange = {
+            'key': key,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {name.lower(): value for name, value in response.headers.items()
+                        if name.lower() not in SKIPPED_HEADERS},
+            'body': content.decode('utf-8') if content else '',
+            'seconds': round(time.time() - start, 6),
+        }
+        with self.lock:
+            self.exchanges.append(exchange)
+        return response
+
+    def _replay(self, key, request):
+        with self.lock:
+            exchanges = self.index.get(key)
+            if not exchanges:
+                self.misses += 1
+                raise CassetteMiss('No recorded response for {0}'.format(key))
+            self.hits += 1
+            exchange = exchanges.popleft() if len(exchanges) > 1 else exchanges[0]
+        if self.latency == 'recorded':
+            time.sleep(exchange['seconds'])
+        response = Response()
+        response.status_code = exchange['status']
+        response.reason = exchange['reason']
+        response.headers = CaseInsensitiveDict(exchange['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = exchange['body'].encode('utf-8')
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        if self.mode == 'record':
+            self.real.close()
+
+
+def report_cassette():
+    if __CASSETTE:
+        if __CASSETTE.mode == 'record':
+            __CASSETTE.save()
+            sys.stderr.write('Cassette {0}: {1} exchanges recorded\n'.format(
+                __CASSETTE.filename, len(__CASSETTE.exchanges)))
+        else:
+            sys.stderr.write('Cassette {0}: {1} replayed, {2} missing\n'.format(
+                __CASSETTE.filename, __CASSETTE.hits, __CASSETTE.misses))
+
+
+def setup_cassette():
+    """Cassette configured from EMPOWERING_CASSETTE (the file),
+    EMPOWERING_CASSETTE_MODE and EMPOWERING_CASSETTE_LATENCY. None when unset.
+    """
+    global __CASSETTE
+    filename = os.getenv('EMPOWERING_CASSETTE')
+    if not filename:
+        return None
+    if not __CASSETTE:
+        __CASSETTE = Cassette(filename, os.getenv('EMPOWERING_CASSETTE_MODE', 'replay'),
+                              os.getenv('EMPOWERING_CASSETTE_LATENCY', 'zero'))
+        atexit.register(report_cassette)
+    return __CASSETTE
@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import Queue
+import atexit
+import threading
+import requests
+
+from utils import setup_namespace
+from session import setup_session
+from pager import ContractPager
+
+__CLEANUP = None
+
+
+class CleanupQueue(object):
+    """Deletes the contracts created by the suites on a bounded pool of workers
+
+    Contracts are queued as (contractId, _etag) pairs. A stale _etag (412)
+    is refreshed with a GET and the delete retried; a 404 means the
+    contract is already gone. With a `namespace` only the contracts in it
+    are ever deleted, so parallel workers never touch each other's
+    contracts.
+
+    sweep() retries the contracts that failed, then lists the namespace's
+    contracts still on the server through `session` and deletes those
+    too. Whatever is left is reported as leaked.
+    """
+    def __init__(self, client, workers=4, retries=3, namespace=None, session=None):
+        self.client = client
+        self.namespace = namespace
+        self.session = session
+        self.retries = retries
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.deleted = 0
+        self.leaked = []
+        self.busy = 0.0
+        self.workers = []
+        for _ in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def add(self, contract_id, etag=None):
+        if contract_id is None:
+            return
+        if self.namespace is not None and contract_id not in self.namespace:
+            return
+        self.queue.put((contract_id, etag))
+
+    def _refresh_etag(self, contract_id):
+        try:
+            return self.client.get_contract(contract_id)['_etag']
+        except requests.exceptions.HTTPError, e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+
+    def _delete(self, contract_id, etag):
+        for attempt in range(self.retries):
+            if etag is None:
+                etag = self._refresh_etag(contract_id)
+                if etag is None:
+                    return True
+            try:
+                self.client.delete_contract(contract_id, etag)
+                return True
+            except requests.exceptions.HTTPError, e:
+                status = e.response.status_code if e.response is not None else None
+                if status == 404:
+                    return True
+                if status != 412:
+                    raise
+                etag = None
+        return False
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            contract_id, etag = item
+            start = time.time()
+            try:
+                deleted = self._delete(contract_id, etag)
+            except Exception:
+                deleted = False
+            with self.lock:
+                self.busy += time.time() - start
+                if deleted:
+                    self.deleted += 1
+                else:
+                    self.leaked.append(contract_id)
+            self.queue.task_done()
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        """Stop the workers once the queued contracts are deleted
+        """
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def leftovers(self):
+        """(contractId, _etag) of the namespace's contracts on the server
+        """
+        if self.session is None or self.namespace is None:
+            return []
+        # Every contractId of the namespace sorts between "<prefix>-" and "<prefix>."
+        prefix = self.namespace.prefix
+        pager = ContractPager(self.session, page_size=500, projection={'contractId': 1},
+                              where={'contractId': {'$gte': prefix + '-', '$lt': prefix + '.'}})
+        return [(item['contractId'], item.get('_etag')) for item in pager
+                if item['contractId'] in self.namespace]
+
+    def sweep(self):
+        start = time.time()
+        self.flush()
+        with self.lock:
+            retried, self.leaked = self.leaked, []
+        for contract_id in retried:
+            self.add(contract_id)
+        self.flush()
+        try:
+            leftovers = self.leftovers()
+        except requests.exceptions.RequestException, e:
+            sys.stderr.write('Cleanup: could not list leftover contracts: {0}\n'.format(e))
+            leftovers = []
+        for contract_id, etag in leftovers:
+            self.add(contract_id, etag)
+        self.flush()
+        return {
+            'deleted': self.deleted,
+            'retried': len(retried),
+            'leftovers': len(leftovers),
+            'leaked': len(self.leaked),
+            'leaked_ids': list(self.leaked),
+            'busy_seconds': round(self.busy, 3),
+            'sweep_seconds': round(time.time() - start, 3),
+        }
+
+
+def report_cleanup():
+    if __CLEANUP:
+        report = __CLEANUP.sweep()
+        __CLEANUP.close()
+        sys.stderr.write('Cleanup: {deleted} contracts deleted ({busy_seconds}s, final sweep '
+                         '{sweep_seconds}s retried {retried} and found {leftovers} leftovers), '
+                         '{leaked} leaked {leaked_ids}\n'.format(**report))
+
+
+def setup_cleanup(client):
+    global __CLEANUP
+    if not __CLEANUP:
+        __CLEANUP = CleanupQueue(client, int(os.getenv('EMPOWERING_CLEANUP_WORKERS', 4)),
+                                 namespace=setup_namespace(), session=setup_session())
+        atexit.register(report_cleanup)
+    return __CLEANUP
@@ -0,0 +1,143 @@
+import os
+import sys
+import atexit
+import threading
+import urlparse
+from collections import OrderedDict
+
+from requests.adapters import BaseAdapter
+
+RESOURCE = 'contracts'
+WRITE_METHODS = ['PATCH', 'PUT', 'DELETE']
+
+__CACHE = None
+
+
+def contract_key(url):
+    """contractId of an item url of the contracts resource, else None
+    """
+    parts = urlparse.urlsplit(url)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    if RESOURCE not in segments:
+        return None
+    lookup = segments[segments.index(RESOURCE) + 1:]
+    return lookup[0] if len(lookup) == 1 else None
+
+
+class ContractCache(BaseAdapter):
+    """requests adapter answering repeated contract GETs from memory
+
+    Wraps the adapter that does the actual requests. Contract documents are
+    kept with their ETag, GETs of a cached contract send If-None-Match and
+    a 304 is served from the cached body. PATCH, PUT and DELETE of a contract
+    drop its entry. The least recently used entries are evicted to stay
+    under `max_bytes` of cached bodies.
+    """
+    def __init__(self, adapter, max_bytes=16 * 1024 * 1024):
+        BaseAdapter.__init__(self)
+        self.adapter = adapter
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+            return entry
+
+    def _store(self, key, etag, response):
+        body = response.content
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            self._drop(key)
+            self.entries[key] = (etag, body, dict(response.headers))
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+        return entry
+
+    def invalidate(self, contract_id=None):
+        with self.lock:
+            if contract_id is None:
+                self.entries.clear()
+                self.size = 0
+            elif self._drop(contract_id) is not None:
+                self.invalidations += 1
+
+    def send(self, request, **kwargs):
+        key = contract_key(request.url)
+        if key is None or '?' in request.url:
+            return self.adapter.send(request, **kwargs)
+        if request.method in WRITE_METHODS:
+            self.invalidate(key)
+            return self.adapter.send(request, **kwargs)
+        if request.method != 'GET':
+            return self.adapter.send(request, **kwargs)
+
+        entry = self._get(key)
+        if entry is not None:
+            request.headers['If-None-Match'] = entry[0]
+        response = self.adapter.send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            etag, body, headers = entry
+            response.status_code = 200
+            response.reason = 'OK'
+            response.headers.update(headers)
+            response._content = body
+            with self.lock:
+                self.hits += 1
+                self.bytes_saved += len(body)
+            return response
+        with self.lock:
+            self.misses += 1
+        if response.status_code == 200:
+            etag = response.headers.get('ETag')
+            if etag:
+                self._store(key, etag, response)
+        elif response.status_code == 404:
+            self.invalidate(key)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'bytes_saved': self.bytes_saved,
+                    'entries': len(self.entries), 'bytes': self.size,
+                    'invalidations': self.invalidations, 'evictions': self.evictions}
+
+
+def report_cache():
+    if __CACHE:
+        sys.stderr.write('Contract cache: {hits} hits, {misses} misses, {bytes_saved} bytes '
+                         'saved, {evictions} evicted, {invalidations} invalidated\n'.format(
+                             **__CACHE.stats()))
+
+
+def setup_contract_cache(adapter):
+    """ContractCache over `adapter` sized by EMPOWERING_CACHE_BYTES, None when unset
+    """
+    global __CACHE
+    max_bytes = os.getenv('EMPOWERING_CACHE_BYTES')
+    if not max_bytes:
+        return None
+    if not __CACHE:
+        __CACHE = ContractCache(adapter, int(max_bytes))
+        atexit.register(report_cache)
+    return __CACHE
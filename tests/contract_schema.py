@@ -0,0 +1,137 @@
+import re
+import json
+import datetime
+
+import requests
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+DATE_PATTERN = r'^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])T([01]\d|2[0-3]):[0-5]\d:[0-5]\dZ$'
+PROVINCE = r'(0[1-9]|[1-4][0-9]|5[0-2])'
+# The server's messages for dates out of range and codes not matching their
+# pattern are still unknown, the suites expect no message for them yet
+UNVERIFIED = None
+
+# The part of the Empowering contract schema the server rejects contracts for
+CONTRACT_SCHEMA = {
+    'contractId': {'required': True},
+    'meteringPointId': {'required': True},
+    'dateStart': {'required': True, 'type': 'datetime', 'past': True},
+    'dateEnd': {'type': 'datetime', 'after': 'dateStart'},
+    'customer': {
+        'required': True,
+        'schema': {
+            'address': {
+                'schema': {
+                    'cityCode': {'regex': '^' + PROVINCE + '[0-9]{3}$'},
+                    'countryCode': {'regex': r'^[A-Z]{2}$'},
+                    'postalCode': {'regex': '^' + PROVINCE + '[0-9]{3}$'},
+                    'provinceCode': {'regex': '^' + PROVINCE + '$'},
+                },
+            },
+        },
+    },
+    'devices': {'required': True},
+}
+
+__VALIDATOR = None
+
+
+def _compile(schema, path=()):
+    """Flatten `schema` into (path, field, rules) checks, regexes compiled
+    """
+    checks = []
+    # Fields compared to another one go after it
+    for field in sorted(schema, key=lambda field: ('after' in schema[field], field)):
+        rules = dict(schema[field])
+        if 'regex' in rules:
+            rules['regex'] = re.compile(rules['regex'])
+        nested = rules.pop('schema', None)
+        checks.append((path, field, rules))
+        if nested:
+            checks.extend(_compile(nested, path + (field,)))
+    return checks
+
+
+class ContractValidator(object):
+    """Validates contracts locally, with the _issues the server would answer
+
+    Issues are keyed by field name only, nested fields included, as the
+    Empowering API reports them. Only 'required field' and 'must be of
+    datetime type' are the server's messages, the other issues carry
+    UNVERIFIED. Dates are checked as strings: the fixed format sorts like
+    the dates it holds.
+    """
+    date_regex = re.compile(DATE_PATTERN)
+
+    def __init__(self, schema=CONTRACT_SCHEMA):
+        self.checks = _compile(schema)
+
+    def validate(self, document, now=None):
+        now = now or datetime.datetime.utcnow().strftime(DATE_FORMAT)
+        issues = {}
+        parents = {(): document}
+        for path, field, rules in self.checks:
+            parent = parents.get(path)
+            value = parent.get(field) if isinstance(parent, dict) else None
+            if value is None:
+                if rules.get('required') and isinstance(parent, dict):
+                    issues[field] = 'required field'
+                continue
+            parents[path + (field,)] = value
+            if rules.get('type') == 'datetime':
+                if not isinstance(value, basestring) or not self.date_regex.match(value):
+                    issues[field] = 'must be of datetime type'
+                    parents.pop(path + (field,))
+                    continue
+                if rules.get('past') and value > now:
+                    issues[field] = UNVERIFIED
+                after = parents.get(path + (rules.get('after'),))
+                if after is not None and value < after:
+                    issues[field] = UNVERIFIED
+                    # Only the later date is reported, as in test_new_13
+                    issues.pop(rules['after'], None)
+            regex = rules.get('regex')
+            if regex and not regex.match(unicode(value)):
+                issues[field] = UNVERIFIED
+        return issues
+
+    def validate_many(self, documents):
+        now = datetime.datetime.utcnow().strftime(DATE_FORMAT)
+        return [self.validate(document, now) for document in documents]
+
+    def partition(self, documents):
+        """(valid documents, [(index, document, issues)] of the invalid ones)
+        """
+        valid = []
+        invalid = []
+        for index, (document, issues) in enumerate(zip(documents, self.validate_many(documents))):
+            if issues:
+                invalid.append((index, document, issues))
+            else:
+                valid.append(document)
+        return valid, invalid
+
+    def cross_check(self, client, document, cleanup=None):
+        """Post `document` and return (local issues, server issues)
+
+        A contract the server accepts is deleted, or handed to `cleanup`.
+        """
+        local = self.validate(document)
+        try:
+            result = client.add_contract(document)
+        except requests.exceptions.HTTPError, e:
+            if e.response is None or e.response.status_code != 422:
+                raise
+            return local, json.loads(e.response.content).get('_issues', {})
+        if cleanup is not None:
+            cleanup.add(result['contractId'], result['_etag'])
+        else:
+            client.delete_contract(result['contractId'], result['_etag'])
+        return local, {}
+
+
+def validate_contract(document):
+    global __VALIDATOR
+    if not __VALIDATOR:
+        __VALIDATOR = ContractValidator()
+    return __VALIDATOR.validate(document)
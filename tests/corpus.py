@@ -0,0 +1,244 @@
+"""Synthetic contract corpus generator
+
+Every contract is a copy of data/test_new_contract1.json with its ids,
+tariff, power, dates, address, building data and profile generated; any
+other field is kept from the fixture. Values are drawn in column batches
+with numpy; every batch gets its own RandomState
+seeded from (seed, batch number), so a given --seed and --batch-size
+always produce the same corpus, whatever the number of --workers.
+Batches are streamed to disk in order as they are rendered, either as
+JSON lines or as length-prefixed zlib-compressed marshal blocks.
+
+    python corpus.py --count 1000000 --seed 1 --workers 4 --output corpus.jsonl
+"""
+import os
+import sys
+import zlib
+import json
+import struct
+import marshal
+import argparse
+import binascii
+import datetime
+import itertools
+import multiprocessing
+
+import numpy
+
+from utils import byteify
+
+TEMPLATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'data', 'test_new_contract1.json')
+TARIFFS = ['2.0A', '2.0DHA', '2.1A', '2.1DHA', '3.0A']
+TARIFF_POWERS = {
+    '2.0A': (1150, 10000), '2.0DHA': (1150, 10000),
+    '2.1A': (10001, 15000), '2.1DHA': (10001, 15000),
+    '3.0A': (15001, 50000),
+}
+ADDRESSES = [
+    ('Barcelona', '08019'), ('Girona', '17079'), ('Lleida', '25120'),
+    ('Tarragona', '43148'), ('Reus', '43123'), ('Manresa', '08113'),
+    ('Sabadell', '08187'), ('Terrassa', '08279'), ('Figueres', '17066'),
+    ('Vic', '08298'),
+]
+BUILDING_DATA = {
+    'buildingWindowsFrame': ['PVC', 'aluminium', 'wood', 'mixed'],
+    'buildingWindowsType': ['single_panel', 'double_panel'],
+    'buildingType': ['Apartment', 'Single_house'],
+    'dwellingPositionInBuilding': ['first_floor', 'middle_floor', 'last_floor', 'only_floor'],
+    'buildingHeatingSourceDhw': ['electricity', 'gas', 'gasoil', 'butane', 'district_heating', 'other'],
+    'buildingHeatingSource': ['electricity', 'gas', 'gasoil', 'butane', 'district_heating', 'other'],
+    'buildingSolarSystem': ['installed', 'not_installed'],
+    'dwellingOrientation': ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW'],
+}
+BUILDING_FIELDS = sorted(BUILDING_DATA) + ['dwellingArea', 'buildingConstructionYear']
+PROFILE_FIELDS = ['minorsPersonsNumber', 'workingAgePersonsNumber', 'retiredAgePersonsNumber',
+                  'totalPersonsNumber', 'malePersonsNumber', 'femalePersonsNumber']
+EDUCATION_FIELDS = ['edu_uni', 'edu_sec', 'edu_prim', 'edu_noStudies']
+FIRST_DAY = datetime.date(2010, 1, 1)
+DAYS = [(FIRST_DAY + datetime.timedelta(days=n)).strftime('%Y-%m-%d') for n in range(6 * 365)]
+
+
+def load_template(filename=TEMPLATE_FILE):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def _uuids(rng, size):
+    digits = binascii.hexlify(rng.bytes(16 * size))
+    return ['{0}-{1}-{2}-{3}-{4}'.format(d[:8], d[8:12], d[12:16], d[16:20], d[20:32])
+            for d in (digits[n:n + 32] for n in xrange(0, 32 * size, 32))]
+
+
+def generate_batch(seed, batch, first, size, prefix='SYN'):
+    """Draw the columns of `size` contracts numbered from `first`
+    """
+    rng = numpy.random.RandomState([seed, batch])
+    columns = {
+        'contractId': ['{0}{1:08d}'.format(prefix, n) for n in xrange(first, first + size)],
+        'customerId': _uuids(rng, size),
+        'meteringPointId': _uuids(rng, size),
+        'deviceId': _uuids(rng, size),
+    }
+    tariff = rng.randint(len(TARIFFS), size=size)
+    low = numpy.array([TARIFF_POWERS[t][0] for t in TARIFFS])[tariff]
+    high = numpy.array([TARIFF_POWERS[t][1] for t in TARIFFS])[tariff]
+    columns['tariffId'] = [TARIFFS[t] for t in tariff.tolist()]
+    columns['power'] = (low + (rng.random_sample(size) * (high - low)).astype(int)).tolist()
+    start = rng.randint(365, len(DAYS), size=size)
+    columns['dateStart'] = start.tolist()
+    columns['deviceDateStart'] = (start - rng.randint(1, 365, size=size)).tolist()
+    columns['address'] = numpy.array(ADDRESSES, dtype=object)[
+        rng.randint(len(ADDRESSES), size=size)].tolist()
+    for field, values in sorted(BUILDING_DATA.iteritems()):
+        columns[field] = numpy.array(values, dtype=object)[
+            rng.randint(len(values), size=size)].tolist()
+    columns['dwellingArea'] = rng.randint(30, 300, size=size).tolist()
+    columns['buildingConstructionYear'] = rng.randint(1900, 2015, size=size).tolist()
+
+    minors = rng.randint(0, 4, size=size)
+    working = rng.randint(0, 4, size=size)
+    retired = rng.randint(0, 3, size=size)
+    working[(minors + working + retired) == 0] = 1
+    total = minors + working + retired
+    male = rng.binomial(total, 0.5)
+    adults = working + retired
+    uni = rng.binomial(adults, 0.35)
+    sec = rng.binomial(adults - uni, 0.5)
+    prim = rng.binomial(adults - uni - sec, 0.7)
+    for field, values in [('minorsPersonsNumber', minors), ('workingAgePersonsNumber', working),
+                          ('retiredAgePersonsNumber', retired), ('totalPersonsNumber', total),
+                          ('malePersonsNumber', male), ('femalePersonsNumber', total - male),
+                          ('edu_uni', uni), ('edu_sec', sec), ('edu_prim', prim),
+                          ('edu_noStudies', adults - uni - sec - prim)]:
+        columns[field] = values.tolist()
+    return columns
+
+
+def batch_to_contracts(columns, template):
+    """Copies of `template` with the generated columns filled in, every other
+    field stays as in the template
+    """
+    frozen = marshal.dumps(byteify(template), 2)
+    contracts = []
+    for n in xrange(len(columns['contractId'])):
+        contract = marshal.loads(frozen)
+        customer_id = columns['customerId'][n]
+        city, city_code = columns['address'][n]
+        contract.update({
+            'contractId': columns['contractId'][n],
+            'ownerId': customer_id,
+            'payerId': customer_id,
+            'signerId': customer_id,
+            'power': columns['power'][n],
+            'dateStart': DAYS[columns['dateStart'][n]] + 'T22:00:00Z',
+            'tariffId': columns['tariffId'][n],
+            'meteringPointId': columns['meteringPointId'][n],
+        })
+        customer = contract.setdefault('customer', {})
+        customer['customerId'] = customer_id
+        customer.setdefault('address', {}).update({'city': city, 'cityCode': city_code})
+        building = customer.setdefault('buildingData', {})
+        for field in BUILDING_FIELDS:
+            building[field] = columns[field][n]
+        profile = customer.setdefault('profile', {})
+        for field in PROFILE_FIELDS:
+            profile[field] = columns[field][n]
+        education = profile.setdefault('educationLevel', {})
+        for field in EDUCATION_FIELDS:
+            education[field] = columns[field][n]
+        device = (contract.get('devices') or [{}])[0]
+        device.update({
+            'deviceId': columns['deviceId'][n],
+            'dateStart': DAYS[columns['deviceDateStart'][n]] + 'T00:00:00Z',
+        })
+        contract['devices'] = [device]
+        contracts.append(contract)
+    return contracts
+
+
+def _batches(count, seed, batch_size, prefix):
+    for batch, first in enumerate(xrange(0, count, batch_size)):
+        yield seed, batch, first, min(batch_size, count - first), prefix
+
+
+def generate(count, seed=0, batch_size=10000, prefix='SYN', template=None):
+    """Yield lists of up to `batch_size` contracts, `count` in total
+    """
+    template = template or load_template()
+    for seed, batch, first, size, prefix in _batches(count, seed, batch_size, prefix):
+        yield batch_to_contracts(generate_batch(seed, batch, first, size, prefix), template)
+
+
+def render(contracts, format='jsonl'):
+    if format == 'jsonl':
+        return ''.join(json.dumps(contract, separators=(',', ':')) + '\n'
+                       for contract in contracts)
+    elif format == 'marshal':
+        block = zlib.compress(marshal.dumps(contracts, 2), 1)
+        return struct.pack('<I', len(block)) + block
+    raise ValueError('Unknown corpus format {0}'.format(format))
+
+
+def _render_batch(args):
+    format, template, batch = args
+    return render(batch_to_contracts(generate_batch(*batch), template), format)
+
+
+def write_corpus(filename, count, seed=0, batch_size=10000, prefix='SYN',
+                 format='jsonl', workers=1):
+    """Render the corpus batches on `workers` processes and write them in order
+    """
+    jobs = itertools.izip(itertools.repeat(format), itertools.repeat(load_template()),
+                          _batches(count, seed, batch_size, prefix))
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        blocks = pool.imap(_render_batch, jobs) if pool else itertools.imap(_render_batch, jobs)
+        with open(filename, 'wb') as f:
+            for block in blocks:
+                f.write(block)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return count
+
+
+def read_corpus(filename, format=None):
+    """Stream the contracts of a corpus file one by one
+    """
+    format = format or ('marshal' if filename.endswith('.marshal') else 'jsonl')
+    with open(filename, 'rb') as f:
+        if format == 'jsonl':
+            for line in f:
+                yield json.loads(line)
+            return
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return
+            for contract in marshal.loads(zlib.decompress(f.read(struct.unpack('<I', header)[0]))):
+                yield contract
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Synthetic Empowering contract corpus')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--prefix', default='SYN')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--format', choices=['jsonl', 'marshal'], default=None,
+                        help='Defaults to the --output extension')
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args(argv)
+
+    format = args.format or ('marshal' if args.output.endswith('.marshal') else 'jsonl')
+    start = datetime.datetime.now()
+    count = write_corpus(args.output, args.count, args.seed, args.batch_size, args.prefix,
+                         format, args.workers)
+    sys.stderr.write('{0} contracts written to {1} in {2}\n'.format(
+        count, args.output, datetime.datetime.now() - start))
+
+if __name__ == '__main__':
+    sys.exit(main())
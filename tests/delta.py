@@ -0,0 +1,89 @@
+import json
+
+from difftree import canonical
+
+EMPTY = [None, {}, []]
+
+
+def _size(document):
+    return len(json.dumps(document, separators=(',', ':')))
+
+
+def build_delta(stored, desired):
+    """(patch, removed) turning the `stored` contract into `desired`
+
+    `patch` holds only the changed fields, nested dicts as partial dicts
+    and lists whole. `removed` lists the dotted paths of stored fields
+    missing from `desired`, which a PATCH cannot express. Stored fields
+    that are empty count as missing, so the defaults the server fills in
+    don't force a replacement.
+    """
+    patch = {}
+    removed = []
+    pending = [((), canonical(stored), canonical(desired, None), patch)]
+    while pending:
+        path, old, new, target = pending.pop()
+        for key, value in new.iteritems():
+            if key not in old:
+                target[key] = value
+            elif isinstance(value, dict) and isinstance(old[key], dict):
+                if value != old[key]:
+                    target[key] = {}
+                    pending.append((path + (key,), old[key], value, target[key]))
+            elif value != old[key]:
+                target[key] = value
+        removed.extend('.'.join(path + (key,)) for key in old
+                       if key not in new and old[key] not in EMPTY)
+    return patch, sorted(removed)
+
+
+class DeltaUpdater(object):
+    """Updates contracts sending only what changed
+
+    A PATCH carries the delta against the stored contract. Fields to remove,
+    or a delta bigger than `max_ratio` of the full document, fall back to a
+    PUT of the whole document. An unchanged contract costs no request.
+    """
+    def __init__(self, client, session, max_ratio=0.5):
+        self.client = client
+        self.session = session
+        self.max_ratio = max_ratio
+        self.counts = {'patch': 0, 'put': 0, 'unchanged': 0}
+        self.bytes_sent = 0
+        self.bytes_full = 0
+
+    def plan(self, stored, desired):
+        """('patch', delta), ('put', desired) or ('unchanged', None)
+        """
+        patch, removed = build_delta(stored, desired)
+        if not patch and not removed:
+            return 'unchanged', None
+        if removed or _size(patch) > self.max_ratio * _size(desired):
+            return 'put', desired
+        return 'patch', patch
+
+    def put(self, contract_id, etag, document):
+        response = self.session.put(self.session.endpoint('contracts', contract_id),
+                                    data=json.dumps(document),
+                                    headers={'Content-Type': 'application/json',
+                                             'If-Match': etag})
+        response.raise_for_status()
+        return response.json()
+
+    def update(self, contract_id, desired, stored=None):
+        """Server answer of the update, `stored` (fetched when not given) if unchanged
+        """
+        stored = stored or self.client.get_contract(contract_id)
+        method, body = self.plan(stored, desired)
+        self.counts[method] += 1
+        self.bytes_full += _size(desired)
+        if method == 'unchanged':
+            return stored
+        self.bytes_sent += _size(body)
+        if method == 'put':
+            return self.put(contract_id, stored['_etag'], body)
+        return self.client.update_contract(contract_id, stored['_etag'], body)
+
+    def stats(self):
+        return dict(self.counts, bytes_sent=self.bytes_sent, bytes_full=self.bytes_full,
+                    bytes_saved=self.bytes_full - self.bytes_sent)
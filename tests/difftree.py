@@ -0,0 +1,128 @@
+import json
+import marshal
+import hashlib
+import warnings
+
+from utils import byteify
+from profiling import profiled
+
+# A utf-8 str and its unicode compare unequal with a warning, the leaves
+# they end up at are compared encoded
+warnings.filterwarnings('ignore', category=UnicodeWarning, module=__name__)
+
+SERVER_FIELDS = ['_id', '_etag', '_created', '_updated', '_version', '_links']
+
+
+def _top(tree, ignore):
+    if isinstance(tree, dict) and ignore:
+        return {key: value for key, value in tree.iteritems() if key not in ignore}
+    return tree
+
+
+@profiled('normalization')
+def canonical(tree, ignore=SERVER_FIELDS):
+    return _top(byteify(tree), ignore)
+
+
+def _encode(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def _token(node):
+    # Scalars stand for themselves, containers for a 1-tuple with their digest.
+    # marshal version 0 writes interned and plain strings alike.
+    if isinstance(node, unicode):
+        return node.encode('utf-8')
+    if not isinstance(node, (dict, list)):
+        return node
+    values = []
+    for value in (node.itervalues() if isinstance(node, dict) else node):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif isinstance(value, (dict, list)):
+            value = _token(value)
+        values.append(value)
+    if isinstance(node, dict):
+        content = '{' + marshal.dumps(sorted(zip(map(_encode, node), values)), 0)
+    else:
+        content = '[' + marshal.dumps(values, 0)
+    return (hashlib.sha1(content).digest(),)
+
+
+def node_hash(node):
+    """sha1 digest of a JSON node, stable across key order and encodings
+    """
+    token = _token(node)
+    if isinstance(node, (dict, list)):
+        return token[0]
+    return hashlib.sha1(marshal.dumps(token, 0)).digest()
+
+
+def tree_hash(tree, ignore=SERVER_FIELDS):
+    """Content hash of a contract tree, stable across key order and encodings
+    """
+    return node_hash(_top(tree, ignore)).encode('hex')
+
+
+def _path(path, key):
+    key = _encode(key)
+    return '{0}.{1}'.format(path, key) if path else str(key)
+
+
+@profiled('diff')
+def diff_trees(a, b, ignore=SERVER_FIELDS):
+    """Structural delta turning contract tree `a` into `b`
+
+    Returns {'added': {path: value}, 'removed': {path: value},
+    'changed': {path: [old, new]}} with dotted paths and utf-8 values.
+    Equal subtrees are skipped with a single C level comparison and only
+    the values put in the delta are encoded, the trees are not copied.
+    Lists are compared item by item: the extra items of the longer one
+    are reported as added or removed by index.
+    """
+    delta = {'added': {}, 'removed': {}, 'changed': {}}
+    pending = [('', _top(a, ignore), _top(b, ignore))]
+    while pending:
+        path, old, new = pending.pop()
+        if old == new:
+            continue
+        if isinstance(old, dict) and isinstance(new, dict):
+            for key, old_value in old.iteritems():
+                if key not in new:
+                    delta['removed'][_path(path, key)] = byteify(old_value)
+                else:
+                    pending.append((_path(path, key), old_value, new[key]))
+            for key in new:
+                if key not in old:
+                    delta['added'][_path(path, key)] = byteify(new[key])
+        elif isinstance(old, list) and isinstance(new, list):
+            for index, (old_item, new_item) in enumerate(zip(old, new)):
+                pending.append((_path(path, index), old_item, new_item))
+            for index in range(len(new), len(old)):
+                delta['removed'][_path(path, index)] = byteify(old[index])
+            for index in range(len(old), len(new)):
+                delta['added'][_path(path, index)] = byteify(new[index])
+        elif _encode(old) != _encode(new):
+            # utf-8 str and unicode only compare equal once encoded
+            delta['changed'][path] = [byteify(old), byteify(new)]
+    return delta
+
+
+def is_empty(delta):
+    return not any(delta.itervalues())
+
+
+def load_delta(filename):
+    with open(filename) as f:
+        delta = byteify(json.load(f))
+    for section in ['added', 'removed']:
+        delta.setdefault(section, {})
+    delta['changed'] = {path: list(change) for path, change in delta.get('changed', {}).iteritems()}
+    return delta
+
+
+def dump_delta(delta, filename):
+    with open(filename, 'w') as f:
+        json.dump({section: paths for section, paths in delta.iteritems() if paths}, f,
+                  indent=4, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
@@ -0,0 +1,56 @@
+import os
+
+from profiling import profiled
+
+__READER = None
+
+
+class ErpReader(object):
+    """Chunked multi-ID reads of an ERP model, cached for the whole session
+
+    Records are cached by (id, field set), so asking again for the same
+    contracts and fields costs no XML-RPC round trip.
+    """
+    def __init__(self, erp_client, model='GiscedataPolissa', chunk_size=200):
+        self.model = getattr(erp_client, model)
+        self.chunk_size = chunk_size
+        self.cache = {}
+        self.calls = 0
+
+    @profiled('erp_read')
+    def read(self, ids, fields):
+        """Records of `ids` in the same order, and the list of ids not found
+        """
+        fields = tuple(sorted(set(fields) | set(['id'])))
+        ids = list(ids)
+        pending = [id for id in ids if (id, fields) not in self.cache]
+        for start in range(0, len(pending), self.chunk_size):
+            self.calls += 1
+            for record in self.model.read(pending[start:start + self.chunk_size], list(fields)) or []:
+                if record:
+                    self.cache[(record['id'], fields)] = record
+
+        records = []
+        missing = []
+        for id in ids:
+            record = self.cache.get((id, fields))
+            if record is None:
+                missing.append(id)
+            else:
+                records.append(dict(record))
+        return records, missing
+
+    def invalidate(self, ids=None):
+        if ids is None:
+            self.cache.clear()
+            return
+        ids = set(ids)
+        for key in [key for key in self.cache if key[0] in ids]:
+            del self.cache[key]
+
+
+def setup_erp_reader(erp_client):
+    global __READER
+    if not __READER:
+        __READER = ErpReader(erp_client, chunk_size=int(os.getenv('ERP_READ_CHUNK', 200)))
+    return __READER
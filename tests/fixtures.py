@@ -0,0 +1,111 @@
+import os
+import copy
+import json
+import time
+import marshal
+import tempfile
+import threading
+
+import uempowering
+from profiling import profiled
+
+__FIXTURES = None
+
+
+class FixtureCache(object):
+    """Contract fixtures parsed once per session
+
+    Each file is parsed the first time, or again when its mtime or size
+    change, and its tree kept marshalled. Every tree handed out is its own
+    copy, rebuilt by marshal.loads, so tests are free to mutate it.
+    Contracts are always built by EmpoweringContract.load_from_file, so
+    whatever parsing the client does still happens for each of them.
+    """
+    def __init__(self, directory='data'):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.parse_seconds = 0.0
+        self.copy_seconds = 0.0
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _load(self, path, stamp):
+        start = time.time()
+        with open(path) as f:
+            root = json.load(f)
+        try:
+            frozen = marshal.dumps(root, 2)
+        except ValueError:
+            # Trees marshal can't hold are deep copied instead
+            frozen = root
+        self.parse_seconds += time.time() - start
+        self.entries[path] = (stamp, frozen)
+        return frozen
+
+    @profiled('fixture_load')
+    def tree(self, filename):
+        """A private copy of the contract tree of `filename`
+        """
+        path = self._path(filename)
+        status = os.stat(path)
+        stamp = (status.st_mtime, status.st_size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                frozen = entry[1]
+            else:
+                self.misses += 1
+                frozen = self._load(path, stamp)
+        start = time.time()
+        tree = marshal.loads(frozen) if isinstance(frozen, str) else copy.deepcopy(frozen)
+        self.copy_seconds += time.time() - start
+        return tree
+
+    @profiled('fixture_load')
+    def contract(self, filename):
+        """A contract loaded by the client from `filename`
+        """
+        contract = uempowering.EmpoweringContract()
+        contract.load_from_file(self._path(filename))
+        return contract
+
+    def corpus(self, filename, count=None):
+        """Contracts of a corpus.py file, best in its compact marshal format
+
+        Each record goes through the client's loader from a scratch file.
+        """
+        from corpus import read_corpus
+        fd, scratch = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            for n, root in enumerate(read_corpus(filename)):
+                if count is not None and n >= count:
+                    return
+                with open(scratch, 'w') as f:
+                    json.dump(root, f)
+                contract = uempowering.EmpoweringContract()
+                contract.load_from_file(scratch)
+                yield contract
+        finally:
+            os.remove(scratch)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'parse_seconds': round(self.parse_seconds, 6),
+                'copy_seconds': round(self.copy_seconds, 6)}
+
+
+def setup_fixtures():
+    global __FIXTURES
+    if not __FIXTURES:
+        __FIXTURES = FixtureCache()
+    return __FIXTURES
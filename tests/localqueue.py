@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import uuid
+import Queue
+import atexit
+import threading
+import traceback
+
+from utils import percentiles
+
+__QUEUE = None
+
+
+class LocalJob(object):
+    def __init__(self, func, args, kwargs):
+        self.id = str(uuid.uuid4())
+        self.func = func
+        self.args = args or ()
+        self.kwargs = kwargs or {}
+        self.status = 'queued'
+        self.result = None
+        self.exc_info = None
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.ended_at = None
+
+    def perform(self):
+        self.started_at = time.time()
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+            self.status = 'finished'
+        except Exception:
+            self.status = 'failed'
+            self.exc_info = traceback.format_exc()
+            sys.stderr.write('Job {0} failed:\n{1}'.format(self.id, self.exc_info))
+        self.ended_at = time.time()
+        return self
+
+
+class LocalQueue(object):
+    """In-memory stand-in for the rq queues amoniak enqueues its jobs on
+
+    With no `workers` jobs run inline when enqueued, otherwise on that many
+    threads. Queue depth, wait time and job duration are counted.
+    """
+    def __init__(self, workers=0):
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.depth = 0
+        self.max_depth = 0
+        self.queue = Queue.Queue() if workers else None
+        for _ in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+        self.installed = []
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            self._perform(job)
+            self.queue.task_done()
+
+    def _perform(self, job):
+        with self.lock:
+            self.depth -= 1
+        job.perform()
+
+    def enqueue_call(self, func, args=None, kwargs=None, **options):
+        job = LocalJob(func, args, kwargs)
+        with self.lock:
+            self.jobs.append(job)
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+        if self.queue is None:
+            self._perform(job)
+        else:
+            self.queue.put(job)
+        return job
+
+    def enqueue(self, func, *args, **kwargs):
+        return self.enqueue_call(func, args, kwargs)
+
+    @property
+    def count(self):
+        return self.depth
+
+    def drain(self):
+        if self.queue is not None:
+            self.queue.join()
+
+    def install(self, module):
+        """Send the .delay() of every rq job in `module` to this queue
+        """
+        for name in dir(module):
+            func = getattr(module, name)
+            if callable(func) and callable(getattr(func, 'delay', None)):
+                self.installed.append((func, func.delay))
+                func.delay = self._delay(module, name)
+
+    def _delay(self, module, name):
+        def delay(*args, **kwargs):
+            # Looked up on every call so wrappers installed later apply
+            return self.enqueue_call(getattr(module, name), args, kwargs)
+        return delay
+
+    def uninstall(self):
+        while self.installed:
+            func, delay = self.installed.pop()
+            func.delay = delay
+
+    def stats(self):
+        with self.lock:
+            jobs = list(self.jobs)
+            depth, max_depth = self.depth, self.max_depth
+        done = [job for job in jobs if job.ended_at]
+        return {
+            'enqueued': len(jobs),
+            'finished': len([job for job in done if job.status == 'finished']),
+            'failed': len([job for job in done if job.status == 'failed']),
+            'depth': depth,
+            'max_depth': max_depth,
+            'wait_ms': percentiles([(job.started_at - job.enqueued_at) * 1000 for job in done]),
+            'duration_ms': percentiles([(job.ended_at - job.started_at) * 1000 for job in done]),
+        }
+
+
+def report_queue():
+    if __QUEUE and __QUEUE.jobs:
+        stats = __QUEUE.stats()
+        report = 'Local queue: {enqueued} jobs, {finished} finished, {failed} failed, ' \
+                 'max depth {max_depth}'
+        if stats['depth']:
+            report += ', {depth} still queued'
+        # No percentiles until some job has ended
+        if stats['wait_ms']:
+            report += ', wait p95 {wait_ms[p95]:.0f}ms, duration p95 {duration_ms[p95]:.0f}ms'
+        sys.stderr.write(report.format(**stats) + '\n')
+
+
+def setup_local_queue():
+    """LocalQueue configured from AMONIAK_LOCAL_QUEUE: 'inline' or a number of
+    worker threads. None when unset, jobs then go to the real rq queues.
+    """
+    global __QUEUE
+    mode = os.getenv('AMONIAK_LOCAL_QUEUE')
+    if not mode:
+        return None
+    if not __QUEUE:
+        __QUEUE = LocalQueue(0 if mode == 'inline' else int(mode))
+        atexit.register(report_queue)
+    return __QUEUE
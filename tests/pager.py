@@ -0,0 +1,114 @@
+import os
+import json
+import Queue
+import urllib
+import threading
+
+RESOURCE = 'contracts'
+
+
+class ContractPager(object):
+    """Walks every contract on the server following Eve's _links.next pages
+
+    While the caller goes through a page the next one is already being
+    fetched on a background thread; at most two pages are held in memory.
+    `projection` is an Eve projection dict such as {'contractId': 1}, and
+    `sort` keeps the page order stable across runs, and `where` is an Eve
+    filter such as {'contractId': {'$gte': 'A', '$lt': 'B'}}. `checkpoint` is the
+    href of the next page to read: it can be saved and passed back to
+    resume, and with `checkpoint_file` that happens after every page.
+    """
+    def __init__(self, session, page_size=100, projection=None, sort='contractId',
+                 checkpoint=None, checkpoint_file=None, prefetch=True, where=None):
+        self.session = session
+        self.prefetch = prefetch
+        self.checkpoint_file = checkpoint_file
+        if checkpoint is None and checkpoint_file and os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as f:
+                checkpoint = f.read().strip() or None
+        if checkpoint is None:
+            query = {'max_results': page_size}
+            if projection:
+                query['projection'] = json.dumps(projection, sort_keys=True)
+            if sort:
+                query['sort'] = sort
+            if where:
+                query['where'] = json.dumps(where, sort_keys=True)
+            checkpoint = '{0}?{1}'.format(RESOURCE, urllib.urlencode(sorted(query.items())))
+        self.checkpoint = checkpoint
+        self.pages = 0
+        self.total = None
+
+    def _fetch(self, href):
+        response = self.session.get(self.session.endpoint(href))
+        response.raise_for_status()
+        page = response.json()
+        return page.get('_items', []), page.get('_links', {}).get('next', {}).get('href'), \
+            page.get('_meta', {}).get('total')
+
+    def _prefetched(self, href):
+        """(items, next href, total) per page, fetched one page ahead
+        """
+        pages = Queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def put(page):
+            # Gives up when the caller stopped reading
+            while not stop.is_set():
+                try:
+                    pages.put(page, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            current = href
+            while current:
+                try:
+                    page = self._fetch(current)
+                except Exception, e:
+                    put(e)
+                    return
+                if not put(page):
+                    return
+                current = page[1]
+            put(None)
+
+        thread = threading.Thread(target=fetch)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            stop.set()
+
+    def _sequential(self, href):
+        while href:
+            page = self._fetch(href)
+            yield page
+            href = page[1]
+
+    def _save(self):
+        if self.checkpoint_file:
+            if self.checkpoint:
+                with open(self.checkpoint_file, 'w') as f:
+                    f.write(self.checkpoint)
+            elif os.path.exists(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+
+    def __iter__(self):
+        pages = self._prefetched if self.prefetch else self._sequential
+        for items, next_href, total in pages(self.checkpoint):
+            self.total = total
+            for item in items:
+                yield item
+            self.pages += 1
+            self.checkpoint = next_href
+            self._save()
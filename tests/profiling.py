@@ -0,0 +1,222 @@
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import cProfile
+import pstats
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+__PROFILER = None
+
+
+def _label(code):
+    return '{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name)
+
+
+class TestProfiler(object):
+    """Per-test profiles of a test run
+
+    Every test is wrapped in cProfile (mode 'cprofile') or in a wall clock
+    sampler of thread stacks (mode 'sample'), between start and stop.
+    cProfile only sees the test thread; the sampler sees the test thread
+    and any other thread while it runs a phase, so idle pool threads don't
+    swamp the profile. Code run inside phase() is timed as that phase,
+    excluding the time of phases nested in it, and sampled stacks start
+    with the phase name. Phases run on several threads at once add up, so
+    they can exceed the test time.
+
+    Each test writes <test>.prof or <test>.collapsed (flamegraph.pl input)
+    into `directory`, and a line with its phase times to phases.jsonl.
+    """
+    def __init__(self, mode='sample', directory='profiles', interval=0.005):
+        if mode not in ('sample', 'cprofile'):
+            raise ValueError('Unknown profiling mode {0}'.format(mode))
+        self.mode = mode
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.phase_stacks = {}
+        self.test = None
+        self.thread = None
+        self.started = None
+        self.phases = defaultdict(float)
+        self.stacks = defaultdict(int)
+        self.profile = None
+        self.sampler = None
+        self.stopping = threading.Event()
+        self.tests = 0
+        self.total_phases = defaultdict(float)
+        self.total_samples = 0
+        self.self_samples = defaultdict(int)
+        self.inclusive_samples = defaultdict(int)
+        self.profile_stats = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @contextmanager
+    def phase(self, name):
+        stack = self.phase_stacks.setdefault(threading.current_thread().ident, [])
+        frame = [name, 0.0]
+        stack.append(frame)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            with self.lock:
+                self.phases[name] += elapsed - frame[1]
+
+    def _sample(self):
+        own = threading.current_thread().ident
+        while not self.stopping.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                phases = self.phase_stacks.get(ident)
+                if ident == own or (ident != self.thread and not phases):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_label(frame.f_code))
+                    frame = frame.f_back
+                labels.append('[{0}]'.format(phases[-1][0] if phases else 'other'))
+                with self.lock:
+                    self.stacks[';'.join(reversed(labels))] += 1
+
+    def start(self, test):
+        self.test = test
+        self.thread = threading.current_thread().ident
+        self.started = time.time()
+        self.phases = defaultdict(float)
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.stacks = defaultdict(int)
+            self.stopping.clear()
+            self.sampler = threading.Thread(target=self._sample)
+            self.sampler.daemon = True
+            self.sampler.start()
+
+    def stop(self):
+        if self.test is None:
+            return
+        elapsed = time.time() - self.started
+        name = re.sub(r'[^\w.-]', '_', self.test)
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            filename = os.path.join(self.directory, name + '.prof')
+            self.profile.dump_stats(filename)
+            if self.profile_stats is None:
+                self.profile_stats = pstats.Stats(filename)
+            else:
+                self.profile_stats.add(filename)
+            self.profile = None
+        else:
+            self.stopping.set()
+            self.sampler.join()
+            with open(os.path.join(self.directory, name + '.collapsed'), 'w') as f:
+                for stack, count in sorted(self.stacks.iteritems()):
+                    f.write('{0} {1}\n'.format(stack, count))
+            for stack, count in self.stacks.iteritems():
+                labels = stack.split(';')[1:]
+                self.total_samples += count
+                if labels:
+                    self.self_samples[labels[-1]] += count
+                for label in set(labels):
+                    self.inclusive_samples[label] += count
+
+        phases = dict((phase, round(seconds, 6)) for phase, seconds in self.phases.iteritems())
+        phases['other'] = round(max(elapsed - sum(self.phases.values()), 0), 6)
+        for phase, seconds in phases.iteritems():
+            self.total_phases[phase] += seconds
+        with open(os.path.join(self.directory, 'phases.jsonl'), 'a') as f:
+            f.write(json.dumps({'test': self.test, 'seconds': round(elapsed, 6),
+                                'phases': phases}, sort_keys=True) + '\n')
+        self.tests += 1
+        self.test = None
+
+    def hottest(self, count=20):
+        """[(function, self seconds, inclusive seconds)] of the whole run, hottest first
+        """
+        if self.mode == 'cprofile':
+            if self.profile_stats is None:
+                return []
+            functions = sorted(self.profile_stats.stats.iteritems(), key=lambda item: -item[1][2])
+            return [('{0}:{1}'.format(os.path.basename(function[0]), function[2]),
+                     round(stats[2], 6), round(stats[3], 6))
+                    for function, stats in functions[:count]]
+        functions = sorted(self.self_samples.iteritems(), key=lambda item: -item[1])
+        return [(function, round(samples * self.interval, 6),
+                 round(self.inclusive_samples[function] * self.interval, 6))
+                for function, samples in functions[:count]]
+
+    def report(self, count=20):
+        return {'mode': self.mode, 'tests': self.tests, 'samples': self.total_samples,
+                'phases': dict((phase, round(seconds, 6))
+                               for phase, seconds in self.total_phases.iteritems()),
+                'hottest': self.hottest(count)}
+
+
+@contextmanager
+def _no_phase():
+    yield
+
+
+def phase(name):
+    """Context manager timing `name` for the running test, a no-op when
+    profiling is off
+    """
+    if __PROFILER is None:
+        return _no_phase()
+    return __PROFILER.phase(name)
+
+
+def profiled(name):
+    """Decorator running the function inside phase(`name`)
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if __PROFILER is None:
+                return function(*args, **kwargs)
+            with __PROFILER.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report_profile():
+    if __PROFILER and __PROFILER.tests:
+        report = __PROFILER.report()
+        with open(os.path.join(__PROFILER.directory, 'report.json'), 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+        sys.stderr.write('Profiled {tests} tests ({mode}) into {0}\n'.format(
+            __PROFILER.directory, **report))
+        sys.stderr.write('Phases: {0}\n'.format(', '.join(
+            '{0} {1:.3f}s'.format(phase, seconds)
+            for phase, seconds in sorted(report['phases'].iteritems(), key=lambda item: -item[1]))))
+        for function, own, inclusive in report['hottest']:
+            sys.stderr.write('    {0:8.3f}s {1:8.3f}s  {2}\n'.format(own, inclusive, function))
+
+
+def setup_profiler():
+    """TestProfiler configured from TEST_PROFILE: 'sample' or 'cprofile'.
+    None when unset. Profiles go to TEST_PROFILE_DIR, sampled every
+    TEST_PROFILE_INTERVAL_MS milliseconds.
+    """
+    global __PROFILER
+    mode = os.getenv('TEST_PROFILE')
+    if not mode:
+        return None
+    if not __PROFILER:
+        __PROFILER = TestProfiler(mode, os.getenv('TEST_PROFILE_DIR', 'profiles'),
+                                  float(os.getenv('TEST_PROFILE_INTERVAL_MS', 5)) / 1000)
+        atexit.register(report_profile)
+    return __PROFILER
@@ -0,0 +1,131 @@
+import re
+import sys
+import json
+import time
+import threading
+from collections import defaultdict
+
+from psycopg2.extensions import cursor as base_cursor
+
+EXPLAINED = ('select', 'update', 'insert', 'delete', 'with', 'execute')
+
+
+def normalize_statement(query):
+    """Statement text with literals replaced by ? and VALUES lists collapsed
+    """
+    statement = re.sub(r"'(?:[^']|'')*'", '?', query)
+    statement = re.sub(r'\b\d+(?:\.\d+)?\b', '?', statement)
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    group = r'\((?:[^()]|\([^()]*\))*\)'
+    return re.sub(r'({0})(?:\s*,\s*{0})+'.format(group), r'\1, ...', statement)
+
+
+class QueryLog(object):
+    """Timing, row counts and slow statements of a PgClient
+
+    Statements are aggregated by their normalized text. Those slower than
+    `slow_ms` are written to `stream`, with their EXPLAIN (ANALYZE, BUFFERS)
+    plan when `explain` is set; the plan is taken inside a savepoint that
+    is rolled back, so the statement is not applied twice.
+    """
+    def __init__(self, slow_ms=None, explain=False, stream=None):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.stream = stream or sys.stderr
+        self.lock = threading.Lock()
+        self.statements = defaultdict(lambda: {'count': 0, 'ms': 0.0, 'max_ms': 0.0,
+                                               'rows': 0, 'errors': 0})
+        self.slow = []
+
+    def cursor_factory(self):
+        log = self
+
+        class InstrumentedCursor(base_cursor):
+            def execute(self, query, vars=None):
+                return log.execute(self, query, vars)
+        return InstrumentedCursor
+
+    def execute(self, cursor, query, vars=None):
+        statement = normalize_statement(query)
+        start = time.time()
+        try:
+            result = base_cursor.execute(cursor, query, vars)
+        except Exception:
+            with self.lock:
+                self.statements[statement]['errors'] += 1
+            self.stream.write('Failed executing query: {0}\n'.format(statement))
+            raise
+        elapsed = (time.time() - start) * 1000
+        rows = max(cursor.rowcount, 0)
+        with self.lock:
+            stats = self.statements[statement]
+            stats['count'] += 1
+            stats['ms'] += elapsed
+            stats['max_ms'] = max(stats['max_ms'], elapsed)
+            stats['rows'] += rows
+        if self.slow_ms is not None and elapsed >= self.slow_ms:
+            self._log_slow(cursor, query, vars, statement, elapsed, rows)
+        return result
+
+    def _log_slow(self, cursor, query, vars, statement, elapsed, rows):
+        plan = None
+        if self.explain and cursor.name is None and \
+                statement.lower().startswith(EXPLAINED):
+            plan = self._plan(cursor.connection, query, vars)
+        with self.lock:
+            self.slow.append({'statement': statement, 'ms': round(elapsed, 3), 'rows': rows,
+                              'plan': plan})
+        self.stream.write('Slow query ({0:.1f}ms, {1} rows): {2}\n'.format(
+            elapsed, rows, statement))
+        if plan:
+            self.stream.write('\n'.join('    ' + line for line in plan) + '\n')
+
+    def _plan(self, conn, query, vars):
+        cr = conn.cursor(cursor_factory=base_cursor)
+        try:
+            base_cursor.execute(cr, 'SAVEPOINT query_log_explain')
+            try:
+                base_cursor.execute(cr, 'EXPLAIN (ANALYZE, BUFFERS) ' + query, vars)
+                return [row[0] for row in cr.fetchall()]
+            finally:
+                base_cursor.execute(cr, 'ROLLBACK TO SAVEPOINT query_log_explain')
+                base_cursor.execute(cr, 'RELEASE SAVEPOINT query_log_explain')
+        except Exception, e:
+            return ['EXPLAIN failed: {0}'.format(e)]
+        finally:
+            cr.close()
+
+    def summary(self):
+        with self.lock:
+            statements = dict((statement, dict(stats, ms=round(stats['ms'], 3),
+                                               max_ms=round(stats['max_ms'], 3)))
+                              for statement, stats in self.statements.iteritems())
+            return {'statements': statements,
+                    'count': sum(stats['count'] for stats in statements.itervalues()),
+                    'ms': round(sum(stats['ms'] for stats in statements.itervalues()), 3),
+                    'slow': list(self.slow)}
+
+    def reset(self):
+        with self.lock:
+            self.statements.clear()
+            self.slow = []
+
+    def dump(self, name, filename=None):
+        """Append the summary since the last dump to `filename` as a JSON line
+        named `name`, or write its five costliest statements to the stream
+        """
+        summary = dict(self.summary(), test=name)
+        self.reset()
+        if not summary['count']:
+            return summary
+        line = json.dumps(summary, sort_keys=True) + '\n'
+        if filename:
+            with open(filename, 'a') as f:
+                f.write(line)
+        else:
+            top = sorted(summary['statements'].iteritems(), key=lambda item: -item[1]['ms'])[:5]
+            self.stream.write('Queries of {test}: {count} in {ms}ms\n'.format(**summary))
+            for statement, stats in top:
+                self.stream.write('    {count} x {ms}ms {rows} rows: {0}\n'.format(
+                    statement[:200], **stats))
+        return summary
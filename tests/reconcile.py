@@ -0,0 +1,197 @@
+"""ERP vs Empowering reconciliation
+
+Streams the contracts of giscedata_polissa (id, name) and every contract
+in Empowering, both sorted by contract name. ERP contracts are converted
+into the Empowering shape, and each side is reduced to a content hash as
+it streams by, without server fields and empty values. The two streams
+are merged, and the contracts whose hashes differ are diffed right away
+from the converted and listed documents to list the changed fields.
+Prints a JSON drift report.
+
+    python reconcile.py --where "state = 'activa'" --output drift.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from utils import setup_pg, setup_empowering
+from session import setup_session
+from difftree import diff_trees, tree_hash
+from pager import ContractPager
+from delta import EMPTY
+from bulk import chunks
+
+
+class ReconcileError(Exception):
+    pass
+
+
+def prune(tree):
+    """`tree` without empty values, null and missing fields compare equal
+    """
+    if isinstance(tree, dict):
+        pruned = {}
+        for key, value in tree.iteritems():
+            if isinstance(value, (dict, list)):
+                value = prune(value)
+            if value not in EMPTY:
+                pruned[key] = value
+        return pruned
+    if isinstance(tree, list):
+        return [prune(value) if isinstance(value, (dict, list)) else value for value in tree]
+    return tree
+
+
+def erp_contracts(pg_client, where=None):
+    """(id, name) of giscedata_polissa in the order Empowering sorts contractIds
+    """
+    query = 'SELECT id, name FROM giscedata_polissa'
+    if where:
+        query += ' WHERE {0}'.format(where)
+    return pg_client.stream(query + ' ORDER BY name COLLATE "C"')
+
+
+def merge(erp_rows, remote_items):
+    """(name, ERP row, Empowering item) of both sorted streams, None on the missing side
+    """
+    def keyed(items, key, side):
+        last = None
+        for item in items:
+            name = str(key(item))
+            if last is not None and name <= last:
+                raise ReconcileError('{0} contracts not sorted at {1}'.format(side, name))
+            last = name
+            yield name, item
+
+    erp = keyed(erp_rows, lambda row: row[1], 'ERP')
+    remote = keyed(remote_items, lambda item: item['contractId'], 'Empowering')
+    left = next(erp, None)
+    right = next(remote, None)
+    while left or right:
+        if right is None or (left and left[0] < right[0]):
+            yield left[0], left[1], None
+            left = next(erp, None)
+        elif left is None or right[0] < left[0]:
+            yield right[0], None, right[1]
+            right = next(remote, None)
+        else:
+            yield left[0], left[1], right[1]
+            left = next(erp, None)
+            right = next(remote, None)
+
+
+class Reconciler(object):
+    """Drift between the ERP contracts and the Empowering ones
+
+    `convert` maps a list of ERP ids to {id: contract} in the Empowering
+    shape, as amoniak builds them. ERP contracts are converted and hashed
+    `batch_size` at a time on `workers` threads, at most `window` batches
+    ahead of the merge, so memory stays bounded whatever the number of
+    contracts. Only the listing page and the batches in flight are held.
+    """
+    def __init__(self, session, convert, page_size=1000, batch_size=100, workers=8,
+                 window=None):
+        self.session = session
+        self.convert = convert
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.window = window or 2 * workers
+        self.pool = ThreadPool(workers)
+
+    def _hash(self, rows):
+        """(id, name, content hash, pruned contract) of ERP `rows`, hash and
+        contract None for contracts not converted
+        """
+        documents = self.convert([row[0] for row in rows])
+        hashed = []
+        for row in rows:
+            document = documents.get(row[0])
+            if document is None:
+                hashed.append((row[0], row[1], None, None))
+                continue
+            document = prune(document)
+            hashed.append((row[0], row[1], tree_hash(document), document))
+        return hashed
+
+    def _hashed(self, erp_rows):
+        # The next batch is only read from erp_rows when the oldest one is
+        # taken, ThreadPool.imap would drain the whole cursor up front
+        batches = chunks(erp_rows, self.batch_size)
+        pending = deque(self.pool.apply_async(self._hash, (batch,))
+                        for batch in itertools.islice(batches, self.window))
+        while pending:
+            rows = pending.popleft().get()
+            for batch in itertools.islice(batches, 1):
+                pending.append(self.pool.apply_async(self._hash, (batch,)))
+            for row in rows:
+                yield row
+
+    def run(self, erp_rows):
+        start = time.time()
+        report = {'erp': 0, 'empowering': 0, 'in_sync': 0, 'missing': [], 'extra': [],
+                  'changed': {}, 'unconverted': [], 'diffed': 0}
+        pager = ContractPager(self.session, page_size=self.page_size)
+        for name, row, item in merge(self._hashed(erp_rows), pager):
+            report['erp'] += row is not None
+            report['empowering'] += item is not None
+            if item is None:
+                report['missing'].append(name)
+            elif row is None:
+                report['extra'].append(name)
+            elif row[2] is None:
+                report['unconverted'].append(name)
+            else:
+                remote = prune(item)
+                if row[2] == tree_hash(remote):
+                    report['in_sync'] += 1
+                    continue
+                report['diffed'] += 1
+                delta = diff_trees(row[3], remote)
+                paths = sorted(path for kind in delta.itervalues() for path in kind)
+                if paths:
+                    report['changed'][name] = paths
+                else:
+                    # Equal values of another type, like 1 and 1.0
+                    report['in_sync'] += 1
+        report['seconds'] = round(time.time() - start, 3)
+        return report
+
+
+def amoniak_converter(erp_client):
+    from amoniak.amon import AmonConverter
+    converter = AmonConverter(erp_client)
+
+    def convert(ids):
+        return dict(zip(ids, converter.contract_to_amon(ids)))
+    return convert
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ERP vs Empowering contract drift report')
+    parser.add_argument('--where', default=None, help='SQL filter of giscedata_polissa')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--output', default=None, help='Write the report to this file')
+    args = parser.parse_args(argv)
+
+    from amoniak.utils import setup_peek
+    os.environ['EMPOWERING_CONCURRENCY'] = str(args.workers)
+    setup_empowering()
+    reconciler = Reconciler(setup_session(), amoniak_converter(setup_peek()),
+                            args.page_size, args.batch_size, args.workers)
+    report = reconciler.run(erp_contracts(setup_pg(), args.where))
+
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print output
+
+if __name__ == '__main__':
+    sys.exit(main())
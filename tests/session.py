@@ -0,0 +1,119 @@
+import os
+import sys
+import atexit
+import requests
+from requests.adapters import HTTPAdapter
+
+from cassette import setup_cassette
+from contract_cache import setup_contract_cache
+from profiling import profiled
+
+__SESSION = None
+
+
+class EmpoweringSession(requests.Session):
+    """requests session shared by every Empowering call of a test run
+
+    Connections are kept alive in a pool per host, so the mutual TLS
+    handshake is paid once per pooled connection instead of once per call.
+    Python 2.7's ssl module has no session tickets API, keep-alive is the
+    only way to skip the handshake.
+    """
+    def __init__(self, url, cert=None, key=None, company_id=None, pool_size=10, hosts=1):
+        requests.Session.__init__(self)
+        self.url = url.rstrip('/') if url else url
+        self.adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size)
+        self.mount('https://', self.adapter)
+        self.mount('http://', self.adapter)
+        if cert and key:
+            self.cert = (cert, key)
+        if company_id:
+            self.headers['X-CompanyId'] = str(company_id)
+
+    @profiled('http')
+    def request(self, method, url, **kwargs):
+        return requests.Session.request(self, method, url, **kwargs)
+
+    def endpoint(self, *parts):
+        return '/'.join([self.url] + [str(part).strip('/') for part in parts])
+
+    def connection_stats(self):
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            host = '{0}://{1}:{2}'.format(pool.scheme, pool.host, pool.port)
+            stats[host] = {'connections': pool.num_connections,
+                           'requests': pool.num_requests}
+        return stats
+
+
+_ORIGINALS = []
+
+
+def install_session(session):
+    """Route the module level requests calls to the Empowering URL, the ones
+    uempowering makes, through `session`. Requests to any other URL go
+    through the functions installed before, until uninstall_session.
+    """
+    if not session.url:
+        return
+    prefix = session.url + '/'
+    original = requests.api.request
+
+    def request(method, url, **kwargs):
+        if url == session.url or url.startswith(prefix):
+            return session.request(method, url, **kwargs)
+        return original(method, url, **kwargs)
+    _ORIGINALS.append((requests.api.request, requests.request))
+    requests.api.request = request
+    requests.request = request
+
+
+def uninstall_session():
+    if _ORIGINALS:
+        requests.api.request, requests.request = _ORIGINALS.pop()
+
+
+def pool_size():
+    """Connections kept per host: EMPOWERING_POOL_SIZE, or one for each of the
+    EMPOWERING_CONCURRENCY threads of the run and the EMPOWERING_CLEANUP_WORKERS
+    """
+    size = os.getenv('EMPOWERING_POOL_SIZE')
+    if size:
+        return int(size)
+    return int(os.getenv('EMPOWERING_CONCURRENCY', 1)) + \
+        int(os.getenv('EMPOWERING_CLEANUP_WORKERS', 4))
+
+
+def report_connections():
+    if __SESSION:
+        for host, stats in sorted(__SESSION.connection_stats().iteritems()):
+            sys.stderr.write('Connections to {0}: {connections} opened for '
+                             '{requests} requests\n'.format(host, **stats))
+
+
+def setup_session(config=None):
+    """The session of the run, created from `config` on the first call
+    """
+    global __SESSION
+    if not __SESSION:
+        __SESSION = EmpoweringSession(config['url'], config.get('cert'), config.get('key'),
+                                      config.get('company_id'), pool_size())
+        adapter = setup_cassette() or __SESSION.adapter
+        adapter = setup_contract_cache(adapter) or adapter
+        __SESSION.mount('https://', adapter)
+        __SESSION.mount('http://', adapter)
+        install_session(__SESSION)
+        atexit.register(teardown_session)
+        if os.getenv('EMPOWERING_CONNECTION_STATS'):
+            atexit.register(report_connections)
+    return __SESSION
+
+
+def teardown_session():
+    """Put back the requests functions and close the pooled connections
+    """
+    if __SESSION:
+        uninstall_session()
+        __SESSION.close()
@@ -0,0 +1,245 @@
+"""Contract lifecycle soak run
+
+Loops add_contract, get_contract, update_contract and delete_contract on
+fresh contracts at --rate lifecycles per second for --duration seconds,
+and with --pg also an update/restore of a few giscedata_polissa rows
+through PgClient. Every --interval seconds it samples RSS, open file
+descriptors and sockets, Postgres connections and latency percentiles,
+then flags the metrics that keep growing. A contract whose lifecycle fails
+after it was added is handed to the cleanup queue and counted as an
+orphan. Prints a JSON report and exits with 1 when something is flagged.
+
+    python soak.py --standin --duration 3600 --rate 5 --pg
+"""
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import datetime
+import threading
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+import uempowering
+from utils import percentiles, setup_empowering, setup_namespace, setup_pg
+from fixtures import setup_fixtures
+from cleanup import setup_cleanup
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+TRENDED = ['rss_bytes', 'fds', 'sockets', 'pg_connections', 'p95_ms']
+
+
+def process_sample():
+    with open('/proc/self/statm') as f:
+        rss = int(f.read().split()[1]) * PAGE_SIZE
+    fds = sockets = 0
+    for fd in os.listdir('/proc/self/fd'):
+        fds += 1
+        try:
+            sockets += os.readlink(os.path.join('/proc/self/fd', fd)).startswith('socket:')
+        except OSError:
+            pass
+    return {'rss_bytes': rss, 'fds': fds, 'sockets': sockets}
+
+
+def trend(values, tolerance=0.2):
+    """Least squares slope per interval, growth over the run relative to
+    the first value and whether it is a steady rise above `tolerance`
+    """
+    n = len(values)
+    if n < 3:
+        return {'slope': 0.0, 'growth': 0.0, 'flagged': False}
+    mean_x = (n - 1) / 2.0
+    mean_y = sum(values) / float(n)
+    sxx = sum((x - mean_x) ** 2 for x in range(n))
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    syy = sum((y - mean_y) ** 2 for y in values)
+    slope = sxy / sxx
+    correlation = sxy / (sxx * syy) ** 0.5 if syy else 0.0
+    growth = slope * (n - 1) / max(abs(values[0]), 1)
+    return {'slope': slope, 'growth': growth,
+            'flagged': growth > tolerance and correlation > 0.8}
+
+
+class SoakRunner(object):
+    def __init__(self, client, contract, update, pg_client=None, pg_ids=(), pg_field='etag',
+                 concurrency=4):
+        self.client = client
+        self.contract = contract
+        self.update = update
+        self.namespace = setup_namespace()
+        # Contracts left behind by a failed lifecycle are deleted here
+        self.cleanup = setup_cleanup(client)
+        self.pg_client = pg_client
+        self.pg_ids = list(pg_ids)
+        self.pg_field = pg_field
+        self.pool = ThreadPool(concurrency)
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.lifecycles = 0
+        self.errors = 0
+        self.first_error = None
+        self.orphans = 0
+        self.running = 0
+
+    def _timed(self, operation, call, *args):
+        start = time.time()
+        result = call(*args)
+        with self.lock:
+            self.latencies[operation].append((time.time() - start) * 1000)
+        return result
+
+    def _clone(self, template, contract_id=None):
+        contract = uempowering.EmpoweringContract()
+        contract.root = self.namespace.rename(copy.deepcopy(template.root), contract_id)
+        return contract
+
+    def lifecycle(self, n):
+        contract_id = None
+        try:
+            contract = self._clone(self.contract)
+            self._timed('add', self.client.add_contract, contract.dump())
+            contract_id = contract.root['contractId']
+            stored = self._timed('get', self.client.get_contract, contract_id)
+            update = self._clone(self.update, contract_id)
+            updated = self._timed('update', self.client.update_contract, contract_id,
+                                  stored['_etag'], update.dump())
+            self._timed('delete', self.client.delete_contract, contract_id, updated['_etag'])
+            contract_id = None
+            if self.pg_client and self.pg_ids:
+                pg_id = self.pg_ids[n % len(self.pg_ids)]
+                old = self._timed('pg_update', self.pg_client.update_records,
+                                  [(pg_id, self.pg_field, 'soak-{0}'.format(n))])
+                self._timed('pg_restore', self.pg_client.restore_records, old)
+            with self.lock:
+                self.lifecycles += 1
+        except Exception, e:
+            with self.lock:
+                self.errors += 1
+                self.first_error = self.first_error or repr(e)
+        finally:
+            if contract_id is not None:
+                self.cleanup.add(contract_id)
+            with self.lock:
+                self.orphans += contract_id is not None
+                self.running -= 1
+
+    def sample(self, started):
+        with self.lock:
+            latencies, self.latencies = self.latencies, defaultdict(list)
+            sample = {'lifecycles': self.lifecycles, 'errors': self.errors,
+                      'in_flight': self.running}
+        sample['seconds'] = round(time.time() - started, 1)
+        sample.update(process_sample())
+        if self.pg_client:
+            # pg_stat_activity is snapshotted once per transaction, each
+            # sample takes its own from the pool
+            with self.pg_client.connection() as conn:
+                cr = conn.cursor()
+                cr.execute('SELECT count(*) FROM pg_stat_activity '
+                           'WHERE datname = current_database()')
+                sample['pg_connections'] = cr.fetchone()[0]
+        sample['latency_ms'] = {operation: percentiles(values)
+                                for operation, values in latencies.iteritems()}
+        all_latencies = sum(latencies.values(), [])
+        sample['p95_ms'] = percentiles(all_latencies).get('p95') if all_latencies else None
+        return sample
+
+    def run(self, duration, rate, interval, warmup=1):
+        started = time.time()
+        next_sample = started + interval
+        samples = []
+        behind = 0
+        n = 0
+        while time.time() - started < duration:
+            due = started + n / float(rate)
+            now = time.time()
+            if now >= next_sample:
+                samples.append(self.sample(started))
+                now = time.time()
+                # A slow sample skips the sampling times it overran
+                while next_sample <= now:
+                    next_sample += interval
+            if due > now:
+                time.sleep(max(0, min(due, next_sample) - now))
+                continue
+            if now - due > 1.0 / rate:
+                behind += 1
+            with self.lock:
+                self.running += 1
+            self.pool.apply_async(self.lifecycle, (n,))
+            n += 1
+        self.pool.close()
+        self.pool.join()
+        self.cleanup.flush()
+        samples.append(self.sample(started))
+
+        measured = samples[warmup:]
+        trends = {}
+        for metric in TRENDED:
+            values = [sample[metric] for sample in measured if sample.get(metric) is not None]
+            if values:
+                trends[metric] = trend(values)
+        return {
+            'lifecycles': self.lifecycles,
+            'errors': self.errors,
+            'first_error': self.first_error,
+            'orphans': self.orphans,
+            'behind_schedule': behind,
+            'intervals': samples,
+            'trends': trends,
+            'flagged': sorted(metric for metric, result in trends.iteritems() if result['flagged']),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Contract lifecycle soak run')
+    parser.add_argument('--duration', type=float, default=600, help='Seconds to run')
+    parser.add_argument('--rate', type=float, default=2, help='Lifecycles per second')
+    parser.add_argument('--interval', type=float, default=30, help='Seconds between samples')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--standin', action='store_true',
+                        help='Run against the local stand-in instead of EMPOWERING_URL')
+    parser.add_argument('--latency', default=None,
+                        help='Stand-in latency as <seconds>[,<jitter>]')
+    parser.add_argument('--pg', action='store_true',
+                        help='Also update and restore giscedata_polissa rows (DB_* variables)')
+    parser.add_argument('--pg-rows', type=int, default=10)
+    parser.add_argument('--pg-field', default='etag')
+    parser.add_argument('--output', default=None, help='Write the report to this file')
+    args = parser.parse_args(argv)
+
+    if args.standin:
+        os.environ['EMPOWERING_STANDIN'] = '1'
+    if args.latency:
+        os.environ['EMPOWERING_STANDIN_LATENCY'] = args.latency
+    os.environ['EMPOWERING_CONCURRENCY'] = str(args.concurrency)
+    client = setup_empowering()
+    pg_client = setup_pg() if args.pg else None
+    pg_ids = pg_client.select('SELECT id FROM giscedata_polissa ORDER BY id LIMIT {0}'.format(
+        args.pg_rows)) if pg_client else []
+
+    fixtures = setup_fixtures()
+    runner = SoakRunner(client, fixtures.contract('test_new_contract1.json'),
+                        fixtures.contract('test_update_contract1.json'), pg_client, pg_ids,
+                        args.pg_field, args.concurrency)
+    report = runner.run(args.duration, args.rate, args.interval)
+    report.update({
+        'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'url': os.getenv('EMPOWERING_URL'),
+        'duration': args.duration,
+        'rate': args.rate,
+        'interval': args.interval,
+    })
+
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print output
+    return 1 if report['flagged'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,416 @@
+import os
+import json
+import atexit
+import time
+import random
+import hashlib
+import datetime
+import threading
+import urllib
+import urlparse
+from collections import OrderedDict
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from contract_schema import validate_contract
+
+
+RESOURCE = 'contracts'
+ID_FIELD = 'contractId'
+META_FIELDS = ['_id', '_etag', '_created', '_updated']
+__STANDIN = None
+
+
+def http_date(when):
+    return when.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+
+def merge_nested(document, changes):
+    """`document` updated with `changes`, nested dicts merged as Eve's
+    MERGE_NESTED_DOCUMENTS does
+    """
+    merged = dict(document)
+    for key, value in changes.iteritems():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = merge_nested(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+OPERATORS = {
+    '$gt': lambda value, bound: value is not None and value > bound,
+    '$gte': lambda value, bound: value is not None and value >= bound,
+    '$lt': lambda value, bound: value is not None and value < bound,
+    '$lte': lambda value, bound: value is not None and value <= bound,
+    '$ne': lambda value, bound: value != bound,
+}
+
+
+def matches(document, where):
+    """Whether `document` passes an Eve `where` filter of top level fields,
+    compared for equality or with the OPERATORS. ValueError if unsupported.
+    """
+    if not isinstance(where, dict):
+        raise ValueError('where must be an object')
+    for condition in where.itervalues():
+        if isinstance(condition, dict) and set(condition) - set(OPERATORS):
+            raise ValueError('Unsupported operator in {0}'.format(condition))
+    for field, condition in where.iteritems():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if not all(OPERATORS[operator](value, bound)
+                       for operator, bound in condition.iteritems()):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def document_etag(document):
+    content = {k: v for k, v in document.iteritems() if not k.startswith('_')}
+    return hashlib.sha1(json.dumps(content, sort_keys=True)).hexdigest()
+
+
+class ContractStore(object):
+    """In-memory storage with Eve's meta fields, keyed by contractId
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = OrderedDict()
+
+    def _meta(self, document, created=None):
+        now = datetime.datetime.utcnow()
+        document['_id'] = document.get('_id') or '%024x' % random.getrandbits(96)
+        document['_created'] = created or http_date(now)
+        document['_updated'] = http_date(now)
+        document['_version'] = document.get('_version', 0) + 1
+        document['_etag'] = document_etag(document)
+        document['_links'] = {
+            'self': {'title': 'Contract',
+                     'href': '{0}/{1}'.format(RESOURCE, document[ID_FIELD])}
+        }
+        return document
+
+    def insert(self, document):
+        with self.lock:
+            contract_id = document.get(ID_FIELD)
+            if contract_id in self.documents:
+                return None
+            self.documents[contract_id] = self._meta(dict(document))
+            return dict(self.documents[contract_id])
+
+    def insert_many(self, documents):
+        """All of `documents` or, if any contractId is taken, none of them
+        """
+        with self.lock:
+            ids = [document.get(ID_FIELD) for document in documents]
+            taken = set(id for id in ids if id in self.documents or ids.count(id) > 1)
+            if taken:
+                return None, taken
+            for contract_id, document in zip(ids, documents):
+                self.documents[contract_id] = self._meta(dict(document))
+            return [dict(self.documents[contract_id]) for contract_id in ids], taken
+
+    def find(self, contract_id):
+        with self.lock:
+            document = self.documents.get(contract_id)
+            return dict(document) if document else None
+
+    def page(self, page, max_results, sort=None, where=None):
+        """Documents of 1-based `page` among those matching `where`, and their count
+        """
+        with self.lock:
+            ids = [id for id in self.documents if matches(self.documents[id], where or {})]
+            if sort:
+                ids.sort(reverse=sort.startswith('-'),
+                         key=lambda id: self.documents[id].get(sort.lstrip('-')))
+            start = (page - 1) * max_results
+            return ([dict(self.documents[id]) for id in ids[start:start + max_results]],
+                    len(ids))
+
+    def patch(self, contract_id, changes):
+        with self.lock:
+            document = merge_nested(self.documents[contract_id], changes)
+            self.documents[contract_id] = self._meta(document, document['_created'])
+            return dict(document)
+
+    def replace(self, contract_id, replacement):
+        with self.lock:
+            document = self.documents[contract_id]
+            replacement = dict(replacement, _id=document['_id'], _version=document['_version'])
+            self.documents[contract_id] = self._meta(replacement, document['_created'])
+            return dict(self.documents[contract_id])
+
+    def delete(self, contract_id):
+        with self.lock:
+            return self.documents.pop(contract_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    reasons = {
+        200: 'OK',
+        201: 'CREATED',
+        204: 'NO CONTENT',
+        304: 'NOT MODIFIED',
+        400: 'BAD REQUEST',
+        404: 'NOT FOUND',
+        405: 'METHOD NOT ALLOWED',
+        412: 'PRECONDITION FAILED',
+        422: 'UNPROCESSABLE ENTITY',
+        428: 'PRECONDITION REQUIRED',
+    }
+
+    def log_message(self, format, *args):
+        if self.server.debug:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _respond(self, status, payload=None, headers=None):
+        body = json.dumps(payload) if payload is not None else ''
+        self.send_response(status, self.reasons.get(status))
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, issues=None):
+        payload = {'_status': 'ERR', '_error': {'code': status, 'message': message}}
+        if issues is not None:
+            payload['_issues'] = issues
+        self._respond(status, payload)
+
+    def _route(self):
+        parts = [p for p in urlparse.urlparse(self.path).path.split('/') if p]
+        if RESOURCE not in parts:
+            return None, None
+        lookup = parts[parts.index(RESOURCE) + 1:]
+        return RESOURCE, (urllib.unquote(lookup[0]) if lookup else None)
+
+    def _body(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length)) if length else None
+        except ValueError:
+            return None
+
+    def _handle(self, method):
+        self.server.wait()
+        resource, contract_id = self._route()
+        if resource is None:
+            return self._error(404, 'The requested URL was not found on the server.')
+        handler = getattr(self, '{0}_{1}'.format(
+            method.lower(), 'item' if contract_id else 'collection'), None)
+        if handler is None:
+            return self._error(405, 'The method is not allowed for the requested URL.')
+        if contract_id:
+            return handler(contract_id)
+        return handler()
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def post_collection(self):
+        document = self._body()
+        if isinstance(document, list):
+            return self._post_many(document)
+        if not isinstance(document, dict):
+            return self._error(400, 'Unable to parse the request body.')
+        issues = validate_contract(document)
+        if not issues:
+            created = self.server.store.insert(document)
+            if created is None:
+                issues = {ID_FIELD: "value '{0}' is not unique".format(document[ID_FIELD])}
+        if issues:
+            return self._error(422, 'Insertion failure: 1 document(s) contain(s) error(s)', issues)
+        created['_status'] = 'OK'
+        self._respond(201, created)
+
+    def _post_many(self, documents):
+        """Eve's bulk insert: every document is stored or none is
+        """
+        if not documents or not all(isinstance(document, dict) for document in documents):
+            return self._error(400, 'Unable to parse the request body.')
+        issues = [validate_contract(document) for document in documents]
+        created = None
+        if not any(issues):
+            created, taken = self.server.store.insert_many(documents)
+            for document, document_issues in zip(documents, issues):
+                if document.get(ID_FIELD) in taken:
+                    document_issues[ID_FIELD] = "value '{0}' is not unique".format(document[ID_FIELD])
+        if created is None:
+            failed = len([document_issues for document_issues in issues if document_issues])
+            items = [{'_status': 'ERR', '_issues': document_issues} if document_issues
+                     else {'_status': 'OK'} for document_issues in issues]
+            return self._respond(422, {
+                '_status': 'ERR',
+                '_error': {'code': 422, 'message': 'Insertion failure: {0} document(s) '
+                           'contain(s) error(s)'.format(failed)},
+                '_items': items})
+        for document in created:
+            document['_status'] = 'OK'
+        self._respond(201, {'_status': 'OK', '_items': created})
+
+    def get_collection(self):
+        """Eve's paginated listing with max_results, page, sort and projection
+        """
+        query = dict(urlparse.parse_qsl(urlparse.urlparse(self.path).query))
+        try:
+            max_results = min(int(query.get('max_results', 25)), 1000)
+            page = int(query.get('page', 1))
+            projection = json.loads(query.get('projection') or '{}')
+            where = json.loads(query.get('where') or '{}')
+            matches({}, where)
+        except ValueError:
+            return self._error(400, 'Unable to parse the query.')
+        if max_results < 1 or page < 1:
+            return self._error(400, 'Unable to parse the query.')
+        items, total = self.server.store.page(page, max_results, query.get('sort'), where)
+        if projection:
+            # Either only the fields set to 1 or all but the fields set to 0
+            include = any(projection.itervalues())
+            items = [{key: value for key, value in item.iteritems()
+                      if key in META_FIELDS or
+                      (projection.get(key) if include else key not in projection)}
+                     for item in items]
+
+        def href(page):
+            return '{0}?{1}'.format(RESOURCE, urllib.urlencode(
+                sorted(dict(query, max_results=max_results, page=page).items())))
+        links = {'self': {'title': RESOURCE, 'href': RESOURCE},
+                 'parent': {'title': 'home', 'href': '/'}}
+        last = max(1, (total + max_results - 1) // max_results)
+        if page < last:
+            links['next'] = {'title': 'next page', 'href': href(page + 1)}
+            links['last'] = {'title': 'last page', 'href': href(last)}
+        if page > 1:
+            links['prev'] = {'title': 'previous page', 'href': href(page - 1)}
+        self._respond(200, {'_items': items, '_links': links,
+                            '_meta': {'page': page, 'max_results': max_results, 'total': total}})
+
+    def _find_or_404(self, contract_id):
+        document = self.server.store.find(contract_id)
+        if document is None:
+            self._error(404, 'The requested URL was not found on the server.')
+        return document
+
+    def _check_etag(self, document):
+        etag = self.headers.getheader('If-Match')
+        if not etag:
+            self._error(428, 'To edit a document its etag must be provided using the If-Match header')
+            return False
+        if etag.strip('"') != document['_etag']:
+            self._error(412, "Client and server etags don't match")
+            return False
+        return True
+
+    def get_item(self, contract_id):
+        document = self._find_or_404(contract_id)
+        if document is None:
+            return
+        if (self.headers.getheader('If-None-Match') or '').strip('"') == document['_etag']:
+            return self._respond(304, None, {'ETag': document['_etag']})
+        self._respond(200, document, {'ETag': document['_etag']})
+
+    def patch_item(self, contract_id):
+        document = self._find_or_404(contract_id)
+        if document is None or not self._check_etag(document):
+            return
+        changes = self._body()
+        if not isinstance(changes, dict):
+            return self._error(400, 'Unable to parse the request body.')
+        merged = merge_nested(dict((k, v) for k, v in document.iteritems()
+                                   if not k.startswith('_')), changes)
+        issues = validate_contract(merged)
+        if issues:
+            return self._error(422, 'Update failure: the document contains error(s)', issues)
+        updated = self.server.store.patch(contract_id, changes)
+        updated['_status'] = 'OK'
+        self._respond(200, updated, {'ETag': updated['_etag']})
+
+    def put_item(self, contract_id):
+        document = self._find_or_404(contract_id)
+        if document is None or not self._check_etag(document):
+            return
+        replacement = self._body()
+        if not isinstance(replacement, dict):
+            return self._error(400, 'Unable to parse the request body.')
+        issues = validate_contract(replacement)
+        if issues:
+            return self._error(422, 'Replacement failure: the document contains error(s)', issues)
+        replaced = self.server.store.replace(contract_id, replacement)
+        replaced['_status'] = 'OK'
+        self._respond(200, replaced, {'ETag': replaced['_etag']})
+
+    def delete_item(self, contract_id):
+        document = self._find_or_404(contract_id)
+        if document is None or not self._check_etag(document):
+            return
+        self.server.store.delete(contract_id)
+        self._respond(204)
+
+
+class EmpoweringStandIn(ThreadingMixIn, HTTPServer):
+    """Eve-compatible stand-in of the Empowering contracts endpoint
+
+    Documents live in memory. `latency` (seconds) and `jitter` delay every
+    request to mimic the response times of the real service.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0, debug=False):
+        HTTPServer.__init__(self, (host, port), StandInHandler)
+        self.store = ContractStore()
+        self.latency = latency
+        self.jitter = jitter
+        self.debug = debug
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+    def wait(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def setup_standin():
+    global __STANDIN
+    if not __STANDIN:
+        latency = [float(v) for v in os.getenv('EMPOWERING_STANDIN_LATENCY', '0').split(',')]
+        __STANDIN = EmpoweringStandIn(latency=latency[0],
+                                      jitter=latency[1] if len(latency) > 1 else 0)
+        __STANDIN.start()
+        atexit.register(__STANDIN.stop)
+    return __STANDIN
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from collections import defaultdict
+
+import requests
+
+from utils import percentiles
+
+__TRACKER = None
+
+EVENTS = ['erp_mutation', 'enqueue', 'job_start', 'job_finish', 'first_get']
+STAGES = [
+    ('enqueue', 'erp_mutation', 'enqueue'),
+    ('queue_wait', 'enqueue', 'job_start'),
+    ('job', 'job_start', 'job_finish'),
+    ('visible', 'job_finish', 'first_get'),
+    ('end_to_end', 'erp_mutation', 'first_get'),
+]
+BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+
+class SyncTimeout(Exception):
+    pass
+
+
+class SyncTracker(object):
+    """Timestamps the ERP to Empowering propagation of each contract
+
+    Events are kept per ERP contract id. Job start and finish are only seen
+    when the amoniak job runs in this process (see wrap_job).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = defaultdict(dict)
+        self.wrapped = []
+
+    def mark(self, event, contract_ids, when=None):
+        when = when or time.time()
+        with self.lock:
+            for contract_id in contract_ids:
+                self.events[contract_id].setdefault(event, when)
+
+    def reset(self, contract_ids):
+        with self.lock:
+            for contract_id in contract_ids:
+                self.events.pop(contract_id, None)
+
+    def wrap_job(self, module, name='push_contracts'):
+        original = getattr(module, name)
+        tracker = self
+
+        def job(contracts_id, *args, **kwargs):
+            ids = contracts_id if isinstance(contracts_id, (list, tuple)) else [contracts_id]
+            tracker.mark('job_start', ids)
+            try:
+                return original(contracts_id, *args, **kwargs)
+            finally:
+                tracker.mark('job_finish', ids)
+        job.__dict__.update(original.__dict__)
+        job.__name__ = original.__name__
+        job.__module__ = original.__module__
+        setattr(module, name, job)
+        self.wrapped.append((module, name, original))
+        return job
+
+    def unwrap(self):
+        while self.wrapped:
+            module, name, original = self.wrapped.pop()
+            setattr(module, name, original)
+
+    def _typical_latency(self):
+        with self.lock:
+            done = [events['first_get'] - events['erp_mutation']
+                    for events in self.events.itervalues()
+                    if 'first_get' in events and 'erp_mutation' in events]
+        return percentiles(done).get('p50') if done else None
+
+    def wait_for(self, client, contract_id, name, timeout=60, delay=0.05, factor=1.5, max_delay=2):
+        """Poll get_contract(name) with growing delays until it exists
+
+        The first poll waits for half the median end-to-end latency seen so
+        far, so later contracts of a batch don't hammer the API.
+        """
+        start = self.events.get(contract_id, {}).get('erp_mutation', time.time())
+        typical = self._typical_latency()
+        if typical:
+            time.sleep(max(0, start + typical / 2 - time.time()))
+        deadline = time.time() + timeout
+        while True:
+            try:
+                contract = client.get_contract(name)
+                self.mark('first_get', [contract_id])
+                return contract
+            except requests.exceptions.HTTPError, e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+            if time.time() + delay > deadline:
+                raise SyncTimeout('Contract {0} not in Empowering after {1}s'.format(name, timeout))
+            time.sleep(delay)
+            delay = min(delay * factor, max_delay)
+
+    def report(self):
+        with self.lock:
+            events = [dict(contract_events) for contract_events in self.events.itervalues()]
+        report = {'contracts': len(events)}
+        for stage, begin, end in STAGES:
+            latencies = [(e[end] - e[begin]) * 1000 for e in events if begin in e and end in e]
+            histogram = defaultdict(int)
+            for latency in latencies:
+                bucket = next((b for b in BUCKETS_MS if latency <= b), None)
+                histogram['<={0}ms'.format(bucket) if bucket else '>{0}ms'.format(BUCKETS_MS[-1])] += 1
+            report[stage] = dict(percentiles(latencies), count=len(latencies),
+                                 histogram=dict(histogram))
+        return report
+
+
+def report_sync():
+    if __TRACKER and __TRACKER.events:
+        report = __TRACKER.report()
+        filename = os.getenv('SYNC_REPORT')
+        if filename:
+            with open(filename, 'w') as f:
+                json.dump(report, f, indent=4, sort_keys=True)
+        for stage, _, _ in STAGES:
+            if report[stage]['count']:
+                sys.stderr.write('Sync {0}: {count} contracts, p50 {p50:.0f}ms, p95 {p95:.0f}ms, '
+                                 'max {max:.0f}ms\n'.format(stage, **report[stage]))
+
+
+def setup_sync_tracker():
+    global __TRACKER
+    if not __TRACKER:
+        __TRACKER = SyncTracker()
+        atexit.register(report_sync)
+    return __TRACKER
@@ -4,67 +4,129 @@ import datetime
 import unittest
 import requests
 import ast
-from datadiff import diff
-from utils import byteify, remove_from_dictionary
-
-import uempowering 
+import json
+from utils import setup_empowering, setup_namespace
+from difftree import diff_trees, load_delta
+from cleanup import setup_cleanup
+from contract_schema import ContractValidator
+from session import setup_session
+from bulk import BulkUploader
+from delta import DeltaUpdater
+from fixtures import setup_fixtures
+from profiling import setup_profiler
 
 
 class EmpoweringTestContract(unittest.TestCase):
     client = None
-    to_delete = []
+    cleanup = None
+    namespace = None
+    validator = None
+    fixtures = None
+    profiler = None
+    # 'local' checks invalid contracts without posting them, 'crosscheck'
+    # also asserts the local validator agrees with the server
+    schema_mode = os.getenv('EMPOWERING_SCHEMA')
 
     @classmethod
+    def setUpClass(self):
+        self.client = setup_empowering()
+        self.namespace = setup_namespace()
+        self.cleanup = setup_cleanup(self.client)
+        self.validator = ContractValidator()
+        self.fixtures = setup_fixtures()
+        self.profiler = setup_profiler()
+
+    def setUp(self):
+        self.stored = None
+        if self.profiler:
+            self.profiler.start(self.id())
+
     def tearDown(self):
-        for delete in self.to_delete:
-            (contractId,etag) = delete
-            if contractId is not None and etag is not None:
-                self.client.delete_contract(contractId,etag)
-                self.to_delete.remove(delete)
+        if self.profiler:
+            self.profiler.stop()
+        if self.stored:
+            self.cleanup.add(self.stored['contractId'])
 
-    @classmethod
-    def setUpClass(self):
-        config = {
-            'url': os.getenv('EMPOWERING_URL', None),
-            'key': os.getenv('EMPOWERING_KEY_FILE', None),
-            'cert': os.getenv('EMPOWERING_CERT_FILE', None),
-            'company_id': os.getenv('EMPOWERING_COMPANY_ID', None)
-            }
-        self.client = uempowering.Empowering(config,debug=False)
+    def _load_contract(self, filename, contract_id=None):
+        contract = self.fixtures.contract(filename)
+        self.namespace.rename(contract.root, contract_id)
+        return contract
 
     def _test_OK(self, result):
         self.assertEqual(result['_status'], 'OK')
         if result and isinstance(result,dict):
-            self.to_delete.append((result['contractId'], result['_etag']))
+            self.cleanup.add(result['contractId'], result['_etag'])
 
     def _test_new_OK(self, filename, field):
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', filename))
+        new_contract = self._load_contract(filename)
         result = self.client.add_contract(new_contract.dump())
         self.assertEqual(result[field], new_contract.root[field])
         self._test_OK(result)
 
     def _test_new_missing_OK(self, filename, child, field):
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', filename))
+        new_contract = self._load_contract(filename)
         new_contract.root.get(child,new_contract.root).pop(field)
 
         result = self.client.add_contract(new_contract.dump())
         self._test_OK(result)
 
-    def _test_update_OK(self, contract_filename, update_filename):
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+    def _add_stored(self, contract_filename='test_new_contract1.json'):
+        new_contract = self._load_contract(contract_filename)
         self.client.add_contract(new_contract.dump())
-        contract = self.client.get_contract(new_contract.root['contractId'])
+        return self.client.get_contract(new_contract.root['contractId'])
 
-        update_contract = uempowering.EmpoweringContract()
-        update_contract.load_from_file(os.path.join('data', update_filename))
-        self.client.debug = True
-        result = self.client.update_contract(contract['contractId'], contract['_etag'], update_contract.dump())
-        self._test_OK(result)
+    def _load_update(self, update_filename='test_update_contract1.json'):
+        self.stored = self._add_stored()
+        return self._load_contract(update_filename, self.stored['contractId'])
+
+    def _update(self, update_contract):
+        updater = DeltaUpdater(self.client, setup_session())
+        result = updater.update(self.stored['contractId'], update_contract.dump(), self.stored)
+        return result, updater
+
+    def _test_update_OK(self, contract_filename, update_filename):
+        self.stored = self._add_stored(contract_filename)
+        update_contract = self._load_contract(update_filename, self.stored['contractId'])
+        result, updater = self._update(update_contract)
+        self.assertEqual(result['_status'], 'OK')
+        return result, updater
+
+    def _test_update_ERROR(self, update_contract, field, error=None):
+        result = None
+        try:
+            result, updater = self._update(update_contract)
+        except requests.exceptions.HTTPError, e:
+            self.assertEqual(e.response.status_code, 422)
+            self.assertEqual(e.response.reason, 'UNPROCESSABLE ENTITY')
+            content = json.loads(e.response.content)
+            self.assertEqual(content['_status'], 'ERR')
+            self.assertEqual(content['_issues'].keys(), [field])
+            if error is not None:
+                self.assertEqual(content['_issues'][field], error)
+
+        if result and isinstance(result, dict):
+            self.fail('Request should fail')
+
+    def _test_update_missing_ERROR(self, child, field):
+        update_contract = self._load_update()
+        update_contract.root.get(child, update_contract.root).pop(field)
+        self._test_update_ERROR(update_contract, field, 'required field')
+
+    def _test_update_missing_OK(self, child, field):
+        update_contract = self._load_update()
+        update_contract.root.get(child, update_contract.root).pop(field)
+        result, updater = self._update(update_contract)
+        self.assertEqual(result['_status'], 'OK')
 
     def _test_ERROR(self, new_contract, field, error):
+        if self.schema_mode == 'local':
+            self.assertDictEqual(self.validator.validate(new_contract.dump()), {field: error})
+            return
+        if self.schema_mode == 'crosscheck':
+            local, server = self.validator.cross_check(self.client, new_contract.dump(),
+                                                       self.cleanup)
+            self.assertDictEqual(local, server)
+
         result = None
         try:
             result = self.client.add_contract(new_contract.dump())
@@ -77,13 +139,11 @@ class EmpoweringTestContract(unittest.TestCase):
                                  {field: error})
 
         if result and isinstance(result,dict):
-            self.to_delete.append((result.get('contractId'),
-                                   result.get('_etag')))
+            self.cleanup.add(result.get('contractId'), result.get('_etag'))
             self.fail('Request should fail')
 
     def _test_new_missing_ERROR(self, filename, child, field):
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data',filename))
+        new_contract = self._load_contract(filename)
         new_contract.root.get(child,new_contract.root).pop(field)
         self._test_ERROR(new_contract, field, "required field")
 
@@ -159,8 +219,7 @@ class EmpoweringTestContract(unittest.TestCase):
         """ Post new contract with wrong data: start_date > today()
         """
         contract_filename = 'test_new_contract1.json'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data',contract_filename))
+        new_contract = self._load_contract(contract_filename)
         new_contract.root['dateStart'] = (datetime.datetime.now() +
                                           datetime.timedelta(days=15)).strftime("%Y-%m-%dT%H:%M:%SZ")
         self._test_ERROR(new_contract, 'dateStart', None) # TBD: Error message
@@ -169,8 +228,7 @@ class EmpoweringTestContract(unittest.TestCase):
         """ Post new contract with wrong data: end_data > start_date
         """
         contract_filename = 'test_new_contract1.json'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+        new_contract = self._load_contract(contract_filename)
         new_contract.root['dateEnd'] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
         new_contract.root['dateStart'] = (datetime.datetime.now() + \
                 datetime.timedelta(days=15)).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -180,8 +238,7 @@ class EmpoweringTestContract(unittest.TestCase):
         """ Post new contract with wrong data: fake citycode
         """
         contract_filename = 'test_new_contract1.json'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+        new_contract = self._load_contract(contract_filename)
         new_contract.root['customer']['address']['cityCode'] = '9999999999'
         self._test_ERROR(new_contract, 'cityCode', None) # TBD: Error message
 
@@ -189,8 +246,7 @@ class EmpoweringTestContract(unittest.TestCase):
         """ Post new contract with wrong data: fake countrycode
         """
         contract_filename = 'test_new_contract1.json'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+        new_contract = self._load_contract(contract_filename)
         new_contract.root['customer']['address']['countryCode'] = '9999999999'
         self._test_ERROR(new_contract, 'countryCode', None) # TBD: Error message
 
@@ -198,8 +254,7 @@ class EmpoweringTestContract(unittest.TestCase):
         """ Post new contract with wrong data: fake postal code
         """
         contract_filename = 'test_new_contract1.json'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+        new_contract = self._load_contract(contract_filename)
         new_contract.root['customer']['address']['postalCode'] = '9999999999'
         self._test_ERROR(new_contract, 'postalCode', None) # TBD: Error message
 
@@ -207,29 +262,61 @@ class EmpoweringTestContract(unittest.TestCase):
         """ Post new contract with wrong data: fake provincecode
         """
         contract_filename = 'test_new_contract1.json'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+        new_contract = self._load_contract(contract_filename)
         new_contract.root['customer']['address']['provinceCode'] = '9999999999'
         self._test_ERROR(new_contract, 'provinceCode', None) # TBD: Error message
 
+    def _test_bulk(self, contracts, validator=None):
+        uploader = BulkUploader(setup_session(), batch_size=3, validator=validator)
+        results = list(uploader.upload([contract.dump() for contract in contracts]))
+        for document, item in results:
+            if item['_status'] == 'OK':
+                self.cleanup.add(item['contractId'], item['_etag'])
+        self.assertEqual([document['contractId'] for document, item in results],
+                         [contract.root['contractId'] for contract in contracts])
+        return [item for document, item in results], uploader.stats()
+
+    def test_bulk_1(self):
+        """ Post contracts in batches
+        """
+        contracts = [self._load_contract('test_new_contract1.json') for _ in range(7)]
+        items, stats = self._test_bulk(contracts)
+        self.assertEqual([item['_status'] for item in items], ['OK'] * 7)
+        self.assertEqual([item['contractId'] for item in items],
+                         [contract.root['contractId'] for contract in contracts])
+        self.assertEqual(stats['requests'], 3)
+
+    def test_bulk_2(self):
+        """ Post contracts in batches with wrong data: issues per contract
+        """
+        contracts = [self._load_contract('test_new_contract1.json') for _ in range(5)]
+        contracts[1].root.pop('devices')
+        contracts[3].root['customer']['address']['cityCode'] = '9999999999'
+        for validator in [None, self.validator]:
+            items, stats = self._test_bulk(contracts, validator)
+            self.assertEqual([item['_status'] for item in items],
+                             ['OK', 'ERR', 'OK', 'ERR', 'OK'])
+            self.assertEqual(items[1]['_issues'], {'devices': 'required field'})
+            self.assertEqual(items[3]['_issues'].keys(), ['cityCode'])
+            for contract in contracts:
+                self.namespace.rename(contract.root)
+        self.assertEqual(stats['requests'], 2)
+
     def test_get_1(self):
         """ Get contract
         """
         contract_filename = 'test_new_contract1.json'
-        contract_filename_diff = 'test_new_contract1.diff'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+        contract_filename_delta = 'test_new_contract1.delta.json'
+        new_contract = self._load_contract(contract_filename)
         self.client.add_contract(new_contract.dump())
         contract  = self.client.get_contract(new_contract.root['contractId'])
-        remove_from_dictionary(contract, ['_id', '_etag', '_created', '_updated', '_version', '_links'])
 
-        new_diff = str(diff(byteify(new_contract.root), contract))
-        test_diff = open(os.path.join('data', contract_filename_diff)).read()
-        self.assertEqual(new_diff, test_diff[:-1])
+        new_delta = diff_trees(new_contract.root, contract)
+        test_delta = load_delta(os.path.join('data', contract_filename_delta))
+        self.assertEqual(new_delta, test_delta)
 
         if contract and isinstance(contract, dict):
-            self.to_delete.append((contract.get('contractId'),
-                                   contract.get('_etag')))
+            self.cleanup.add(contract.get('contractId'), contract.get('_etag'))
 
     def test_get_2(self):
         """ Get unknown contract
@@ -242,111 +329,110 @@ class EmpoweringTestContract(unittest.TestCase):
             self.assertEqual(e.response.reason, 'NOT FOUND')
 
         if contract and isinstance(contract, dict):
-            self.to_delete.append(contract.get('contractId'),
-                                   contract.get('_etag'))
+            self.cleanup.add(contract.get('contractId'), contract.get('_etag'))
             self.assertTrue(False)
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_1(self):
         """ Update update contract with all data
         """
+        result, updater = self._test_update_OK('test_new_contract1.json',
+                                               'test_update_contract1.json')
+        self.assertEqual(updater.counts['patch'], 1)
+        self.assertGreater(updater.stats()['bytes_saved'], 0)
+        contract = self.client.get_contract(result['contractId'])
+        self.assertEqual((contract['power'], contract['tariffId']), (11000, '2.1A'))
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_2(self):
         """ Update update contract with data missing: contractId
         """
-        pass
+        self._test_update_missing_ERROR(None, 'contractId')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_3(self):
         """ Update update contract with data missing: meteringPointId
         """
-        pass
+        self._test_update_missing_ERROR(None, 'meteringPointId')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_4(self):
         """ Update update contract with data missing: date start
         """
-        pass
+        self._test_update_missing_ERROR(None, 'dateStart')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_5(self):
         """ Update update contract with data missing: customer
         """
-        pass
+        self._test_update_missing_ERROR(None, 'customer')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_6(self):
         """ Update update contract with data missing: devices
         """
-        pass
+        self._test_update_missing_ERROR(None, 'devices')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_7(self):
         """ Update update contract with optional data missing: customer address
         """
-        pass
+        self._test_update_missing_OK('customer', 'address')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_8(self):
         """ Update update contract with optional data missing: customer buildingData
         """
-        pass
+        self._test_update_missing_OK('customer', 'buildingData')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_9(self):
         """ Update update contract with optional data missing: customer profile
         """
-        pass
+        self._test_update_missing_OK('customer', 'profile')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_10(self):
         """ Update update contract with optional data missing: customisedGroupingCriteria
         """
-        pass
+        self._test_update_missing_OK('customer', 'customisedGroupingCriteria')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_11(self):
         """ Update update contract with optional data missing: customisedServiceParameters
         """
-        pass
+        self._test_update_missing_OK('customer', 'customisedServiceParameters')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_12(self):
         """ Update update contract with wrong data: start_date > today()
         """
-        pass
+        update_contract = self._load_update()
+        update_contract.root['dateStart'] = (datetime.datetime.now() +
+                                             datetime.timedelta(days=15)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self._test_update_ERROR(update_contract, 'dateStart')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_13(self):
         """ Update update contract with wrong data: end_data > start_date
         """
-        pass
+        update_contract = self._load_update()
+        update_contract.root['dateEnd'] = '2013-01-01T00:00:00Z'
+        self._test_update_ERROR(update_contract, 'dateEnd')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_14(self):
         """ Update update contract with wrong data: fake citycode
         """
-        pass
+        update_contract = self._load_update()
+        update_contract.root['customer']['address']['cityCode'] = '9999999999'
+        self._test_update_ERROR(update_contract, 'cityCode')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_15(self):
         """ Update update contract with wrong data: fake countrycode
         """
-        pass
+        update_contract = self._load_update()
+        update_contract.root['customer']['address']['countryCode'] = '9999999999'
+        self._test_update_ERROR(update_contract, 'countryCode')
 
-    @unittest.skip('BeeData PATCH failing')
     def test_update_16(self):
         """ Update update contract with wrong data: fake provincecode
         """
-        pass
+        update_contract = self._load_update()
+        update_contract.root['customer']['address']['provinceCode'] = '9999999999'
+        self._test_update_ERROR(update_contract, 'provinceCode')
 
     def test_delete_1(self):
         """ Delete contract
         """
         contract_filename = 'test_new_contract1.json'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+        new_contract = self._load_contract(contract_filename)
         self.client.add_contract(new_contract.dump())
         contract = self.client.get_contract(new_contract.root['contractId'])
 
@@ -361,8 +447,7 @@ class EmpoweringTestContract(unittest.TestCase):
         """ Delete wrong _etag
         """
         contract_filename = 'test_new_contract1.json'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+        new_contract = self._load_contract(contract_filename)
         self.client.add_contract(new_contract.dump())
         contract = self.client.get_contract(new_contract.root['contractId'])
 
@@ -374,15 +459,13 @@ class EmpoweringTestContract(unittest.TestCase):
             self.assertEqual(e.response.reason,'PRECONDITION FAILED')
 
         if contract and isinstance(contract,dict):
-            self.to_delete.append((contract.get('contractId'),
-                                   contract.get('_etag')))
+            self.cleanup.add(contract.get('contractId'), contract.get('_etag'))
 
     def test_delete_3(self):
         """ Delete wrong contractId
         """
         contract_filename = 'test_new_contract1.json'
-        new_contract = uempowering.EmpoweringContract()
-        new_contract.load_from_file(os.path.join('data', contract_filename))
+        new_contract = self._load_contract(contract_filename)
         self.client.add_contract(new_contract.dump())
         contract = self.client.get_contract(new_contract.root['contractId'])
 
@@ -393,8 +476,7 @@ class EmpoweringTestContract(unittest.TestCase):
             self.assertEqual(e.response.status_code,404)
 
         if contract and isinstance(contract,dict):
-            self.to_delete.append((contract.get('contractId'),
-                                   contract.get('_etag')))
+            self.cleanup.add(contract.get('contractId'), contract.get('_etag'))
 
 if __name__ == '__main__':
     unittest.main()
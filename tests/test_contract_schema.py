@@ -0,0 +1,55 @@
+import json
+import datetime
+import unittest
+
+from contract_schema import ContractValidator, DATE_FORMAT, UNVERIFIED
+
+
+class EmpoweringTestContractSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.validator = ContractValidator()
+        with open('data/test_new_contract1.json') as f:
+            self.contract = json.load(f)
+
+    def test_schema_1(self):
+        """ Fixture contract is valid, missing required fields are reported
+        """
+        self.assertEqual(self.validator.validate(self.contract), {})
+        for field in ['contractId', 'meteringPointId', 'dateStart', 'customer', 'devices']:
+            contract = dict(self.contract)
+            contract.pop(field)
+            self.assertEqual(self.validator.validate(contract), {field: 'required field'})
+
+    def test_schema_2(self):
+        """ Wrong dates and address codes are reported by field name
+        """
+        tomorrow = (datetime.datetime.utcnow() + datetime.timedelta(days=1)).strftime(DATE_FORMAT)
+        contract = dict(self.contract, dateStart=tomorrow)
+        self.assertEqual(self.validator.validate(contract).keys(), ['dateStart'])
+        contract = dict(self.contract, dateStart='2014-13-01T00:00:00Z')
+        self.assertEqual(self.validator.validate(contract),
+                         {'dateStart': 'must be of datetime type'})
+        contract = dict(self.contract, dateStart='2014-05-01T00:00:00Z',
+                        dateEnd='2014-04-01T00:00:00Z')
+        self.assertEqual(self.validator.validate(contract).keys(), ['dateEnd'])
+        # A future dateStart after dateEnd is only reported on dateEnd
+        contract = dict(self.contract, dateStart=tomorrow, dateEnd=self.contract['dateStart'])
+        self.assertEqual(self.validator.validate(contract), {'dateEnd': UNVERIFIED})
+
+        for field in ['cityCode', 'countryCode', 'postalCode', 'provinceCode']:
+            contract = json.loads(json.dumps(self.contract))
+            contract['customer']['address'][field] = '9999999999'
+            self.assertEqual(self.validator.validate(contract).keys(), [field])
+
+    def test_schema_3(self):
+        """ Batches are split into valid contracts and issues per position
+        """
+        invalid = dict(self.contract)
+        invalid.pop('devices')
+        valid, rejected = self.validator.partition([self.contract, invalid, self.contract])
+        self.assertEqual(valid, [self.contract, self.contract])
+        self.assertEqual(rejected, [(1, invalid, {'devices': 'required field'})])
+
+if __name__ == '__main__':
+    unittest.main()
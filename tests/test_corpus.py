@@ -0,0 +1,43 @@
+import unittest
+
+from corpus import generate, render, load_template
+from contract_schema import ContractValidator
+
+
+class EmpoweringTestCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.template = load_template()
+
+    def test_corpus_1(self):
+        """ The same seed renders the same corpus, another seed a different one
+        """
+        first = render(sum(generate(50, seed=7, batch_size=20), []))
+        self.assertEqual(render(sum(generate(50, seed=7, batch_size=20), [])), first)
+        self.assertNotEqual(render(sum(generate(50, seed=8, batch_size=20), [])), first)
+        self.assertEqual(len(first.splitlines()), 50)
+
+    def test_corpus_2(self):
+        """ Every contract passes the contract schema
+        """
+        validator = ContractValidator()
+        for contract in sum(generate(500, seed=1, batch_size=200), []):
+            self.assertEqual(validator.validate(contract), {}, contract['contractId'])
+
+    def test_corpus_3(self):
+        """ Fields of the template that are not generated are kept
+        """
+        self.template['customer']['address']['street'] = 'Pic de Peguera 11'
+        self.template['customer']['profile']['language'] = 'ca'
+        contracts = next(generate(2, template=self.template))
+        for contract in contracts:
+            self.assertEqual(contract['customer']['address']['street'], 'Pic de Peguera 11')
+            self.assertEqual(contract['customer']['profile']['language'], 'ca')
+            self.assertEqual(contract['activityCode'], self.template['activityCode'])
+            self.assertEqual(contract['devices'][0]['dateEnd'], None)
+        self.assertNotEqual(contracts[0]['customer']['customerId'],
+                            self.template['customer']['customerId'])
+        self.assertIsNot(contracts[0]['customer'], contracts[1]['customer'])
+
+if __name__ == '__main__':
+    unittest.main()
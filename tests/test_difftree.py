@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import unittest
+
+from difftree import diff_trees, is_empty, load_delta, tree_hash
+from delta import build_delta
+from utils import byteify
+
+
+class EmpoweringTestDiffTree(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join('data', 'test_new_contract1.json')) as f:
+            self.contract = json.load(f)
+
+    def test_diff_1(self):
+        """ Identical contracts, server fields ignored
+        """
+        server = dict(self.contract, _id='1', _etag='2', _created='3',
+                      _updated='4', _version=1, _links={})
+        self.assertTrue(is_empty(diff_trees(self.contract, server)))
+        self.assertEqual(tree_hash(self.contract), tree_hash(server))
+
+    def test_diff_2(self):
+        """ Nested added, removed and changed fields
+        """
+        other = json.loads(json.dumps(self.contract))
+        other['power'] = 11000
+        other['customer']['address'].pop('cityCode')
+        other['customer']['address']['street'] = None
+        other['devices'][0]['dateEnd'] = '2015-01-01T00:00:00Z'
+
+        delta = diff_trees(self.contract, other)
+        self.assertEqual(delta, {
+            'added': {'customer.address.street': None},
+            'removed': {'customer.address.cityCode': '08019'},
+            'changed': {'power': [5750, 11000],
+                        'devices.0.dateEnd': [None, '2015-01-01T00:00:00Z']},
+        })
+        self.assertNotEqual(tree_hash(self.contract), tree_hash(other))
+
+    def test_diff_3(self):
+        """ Lists compared item by item, str and unicode compare equal
+        """
+        other = json.loads(json.dumps(self.contract))
+        other['devices'].append({'dateStart': '2015-01-01T00:00:00Z'})
+        encoded = dict((key.encode('utf-8'), value) for key, value in self.contract.items())
+        encoded['tariffId'] = encoded['tariffId'].encode('utf-8')
+
+        self.assertEqual(diff_trees(self.contract, other), {
+            'added': {'devices.1': {'dateStart': '2015-01-01T00:00:00Z'}},
+            'removed': {}, 'changed': {},
+        })
+        self.assertEqual(diff_trees(other, self.contract)['removed'].keys(), ['devices.1'])
+        self.assertTrue(is_empty(diff_trees(self.contract, encoded)))
+        self.assertEqual(tree_hash(self.contract), tree_hash(encoded))
+
+        other = json.loads(json.dumps(self.contract))
+        other['customer']['address']['city'] = u'Lleidà'
+        encoded = byteify(other)
+        self.assertTrue(is_empty(diff_trees(other, encoded)))
+        # Nothing is remembered between calls, mutated trees are diffed again
+        encoded['customer']['address']['city'] = 'Girona'
+        self.assertEqual(diff_trees(other, encoded)['changed'],
+                         {'customer.address.city': ['Lleid\xc3\xa0', 'Girona']})
+
+    def test_load_1(self):
+        """ Golden delta files round trip
+        """
+        delta = load_delta(os.path.join('data', 'test_new_contract1.delta.json'))
+        self.assertEqual(delta['added'], {})
+        self.assertEqual(delta['changed'], {})
+        self.assertIn('customer.address.buildingId', delta['removed'])
+
+    def test_delta_1(self):
+        """ PATCH delta holds only the changed fields, nested ones partially
+        """
+        with open(os.path.join('data', 'test_update_contract1.json')) as f:
+            update = json.load(f)
+        stored = dict(self.contract, _id='1', _etag='2')
+        self.assertEqual(build_delta(stored, update), ({'power': 11000, 'tariffId': '2.1A'}, []))
+
+        update = json.loads(json.dumps(self.contract))
+        update['customer']['address']['cityCode'] = '17079'
+        del update['customer']['address']['countryCode']
+        patch, removed = build_delta(self.contract, update)
+        self.assertEqual(patch, {'customer': {'address': {'cityCode': '17079'}}})
+        self.assertEqual(removed, ['customer.address.countryCode'])
+
+if __name__ == '__main__':
+    unittest.main()
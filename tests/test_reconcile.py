@@ -0,0 +1,86 @@
+import os
+import json
+import unittest
+import requests
+
+from standin import EmpoweringStandIn
+from session import EmpoweringSession
+from reconcile import Reconciler, ReconcileError, merge
+
+
+class EmpoweringTestReconcile(unittest.TestCase):
+    server = None
+
+    @classmethod
+    def setUpClass(self):
+        self.server = EmpoweringStandIn().start()
+
+    @classmethod
+    def tearDownClass(self):
+        self.server.stop()
+
+    def setUp(self):
+        self.server.store.clear()
+        with open(os.path.join('data', 'test_new_contract1.json')) as f:
+            self.contract = json.load(f)
+
+    def _post(self, contract):
+        requests.post('{0}/contracts/'.format(self.server.url), data=json.dumps(contract),
+                      headers={'Content-Type': 'application/json'})
+
+    def test_merge_1(self):
+        """ Sorted streams are joined by contract name
+        """
+        rows = [(1, 'A'), (2, 'C')]
+        items = [{'contractId': 'B'}, {'contractId': 'C'}]
+        self.assertEqual([(name, bool(row), bool(item)) for name, row, item in merge(rows, items)],
+                         [('A', True, False), ('B', False, True), ('C', True, True)])
+        with self.assertRaises(ReconcileError):
+            list(merge([(1, 'B'), (2, 'A')], []))
+
+    def test_reconcile_1(self):
+        """ Missing, extra, changed, unconverted and in sync contracts are reported
+        """
+        documents = {}
+        rows = []
+        for n, name in enumerate(['R1', 'R2', 'R3', 'R4', 'R5', 'R6']):
+            documents[n] = dict(self.contract, contractId=name)
+            if name != 'R2':
+                self._post(documents[n])
+            rows.append((n, name))
+        self._post(dict(self.contract, contractId='R7'))
+        documents[2] = dict(documents[2], power=11000)
+        documents[4] = dict(documents[4], tariffId='3.0A')
+        del documents[5]
+
+        reconciler = Reconciler(EmpoweringSession(self.server.url),
+                                lambda ids: {id: documents[id] for id in ids if id in documents},
+                                page_size=2, batch_size=2)
+        report = reconciler.run(rows)
+        self.assertEqual((report['erp'], report['empowering'], report['in_sync']), (6, 6, 2))
+        self.assertEqual(report['missing'], ['R2'])
+        self.assertEqual(report['extra'], ['R7'])
+        self.assertEqual(report['unconverted'], ['R6'])
+        self.assertEqual(report['changed'], {'R3': ['power'], 'R5': ['tariffId']})
+        self.assertEqual(report['diffed'], 2)
+
+    def test_reconcile_2(self):
+        """ ERP rows are read at most `window` batches ahead of the merge
+        """
+        read = []
+
+        def rows():
+            for n in range(100):
+                read.append(n)
+                yield n, 'R{0:03d}'.format(n)
+        reconciler = Reconciler(EmpoweringSession(self.server.url),
+                                lambda ids: {id: self.contract for id in ids},
+                                batch_size=5, workers=2, window=3)
+        hashed = reconciler._hashed(rows())
+        self.assertEqual(next(hashed)[1], 'R000')
+        # The batch taken and the window refilled behind it
+        self.assertEqual(len(read), 4 * 5)
+        self.assertEqual(len(list(hashed)), 99)
+
+if __name__ == '__main__':
+    unittest.main()
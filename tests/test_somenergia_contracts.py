@@ -4,8 +4,13 @@ import datetime
 import unittest
 import requests
 import ast
-from datadiff import diff
-from utils import byteify, remove_from_dictionary, read_list_from_file, setup_pg
+from utils import iter_list_from_file, shard_from_env, setup_pg, setup_empowering
+from difftree import diff_trees, load_delta
+from cleanup import setup_cleanup
+from erp import setup_erp_reader
+from synctrack import setup_sync_tracker
+from localqueue import setup_local_queue
+from profiling import setup_profiler, phase
 
 from amoniak import tasks
 from amoniak.utils import (
@@ -18,57 +23,87 @@ import uempowering
 
 class EmpoweringTestContract(unittest.TestCase):
     erp_client = None
+    erp_reader = None
     pg_client = None
     emp_client = None
-    to_delete = []
+    cleanup = None
+    sync = None
+    queue = None
+    profiler = None
+
+    def setUp(self):
+        if self.profiler:
+            self.profiler.start(self.id())
 
-    @classmethod
     def tearDown(self):
-        for delete in self.to_delete:
-            (contractId,etag) = delete
-            if contractId is not None and etag is not None:
-                self.emp_client.delete_contract(contractId, etag)
-                self.to_delete.remove(delete)
+        if self.profiler:
+            self.profiler.stop()
+        self.cleanup.flush()
+        if os.getenv('PG_QUERY_SUMMARY'):
+            summary = os.getenv('PG_QUERY_SUMMARY')
+            self.pg_client.log.dump(self.id(), None if summary == '-' else summary)
 
     @classmethod
     def setUpClass(self):
         self.erp_client = setup_peek()
-        config = {
-            'url': os.getenv('EMPOWERING_URL', None),
-            'key': os.getenv('EMPOWERING_KEY_FILE', None),
-            'cert': os.getenv('EMPOWERING_CERT_FILE', None),
-            'company_id': os.getenv('EMPOWERING_COMPANY_ID', None)
-            }
-        self.emp_client = uempowering.Empowering(config, debug=False)
+        self.erp_reader = setup_erp_reader(self.erp_client)
+        self.emp_client = setup_empowering()
+        self.cleanup = setup_cleanup(self.emp_client)
         self.pg_client = setup_pg()
+        self.sync = setup_sync_tracker()
+        self.sync.wrap_job(tasks)
+        self.queue = setup_local_queue()
+        self.profiler = setup_profiler()
+        if self.queue:
+            self.queue.install(tasks)
 
-    def _test_OK(self, delete):
-        contracts_id = read_list_from_file((os.path.join('data', 'test_som_new_contract1.csv')), int)
-        new_contracts = []
-        for contract_id in contracts_id:
-            fields_to_read = ['name', 'create_date', 'etag']
-            contract = self.erp_client.GiscedataPolissa.read(contract_id, fields_to_read)
-            if not contract:
-                self.fail('Contract {contract_id} does not exists in ERP database'.format(**locals()))
+    @classmethod
+    def tearDownClass(self):
+        if self.queue:
+            self.queue.drain()
+            self.queue.uninstall()
+        self.sync.unwrap()
 
+    def _test_OK(self, delete):
+        contracts_id = iter_list_from_file(os.path.join('data', 'test_som_new_contract1.csv'), int,
+                                           shard=shard_from_env())
+        fields_to_read = ['name', 'create_date', 'etag']
+        contracts, missing = self.erp_reader.read(contracts_id, fields_to_read)
+        if missing:
+            missing = ', '.join(str(contract_id) for contract_id in missing)
+            self.fail('Contracts {missing} do not exist in ERP database'.format(**locals()))
+
+        for contract in contracts:
             if delete and contract['etag']:
                 try:
                     self.emp_client.delete_contract(contract['name'], contract['etag'])
                 except Exception, e:
                     print 'Contract {contractId} already in database'.format(**{'contractId': contract['name']})
 
-            del os.environ['EMPOWERING_URL']
-            old_date = self.pg_client.update_record(contract_id, 'create_date',
-                                                         datetime.datetime.strftime(datetime.datetime.now(),'%Y-%m-%d %H:%M:%S'))
-            # REQUIREMENT: ASYNC commit disabled
-            old_etag = self.pg_client.update_record(contract_id, 'etag', None)
-            tasks.enqueue_new_contracts(False, [contract['id']])
-            self.pg_client.update_record(contract_id, 'create_date', old_date)
-            #self.pg_client.update_record(contract_id, 'etag', old_etag)
+        del os.environ['EMPOWERING_URL']
+        create_date = datetime.datetime.strftime(datetime.datetime.now(),'%Y-%m-%d %H:%M:%S')
+        contract_ids = [contract['id'] for contract in contracts]
+        self.sync.reset(contract_ids)
+        # etag is written by the sync job, keep it unless the test fails
+        try:
+            with self.pg_client.isolated(contract_ids, ['create_date', 'etag'], keep=['etag']):
+                self.pg_client.update_records(
+                    [(contract_id, 'create_date', create_date) for contract_id in contract_ids] +
+                    [(contract_id, 'etag', None) for contract_id in contract_ids])
+                self.sync.mark('erp_mutation', contract_ids)
+                # Jobs may run asynchronously, wait_for polls until they land
+                with phase('enqueue'):
+                    tasks.enqueue_new_contracts(False, contract_ids)
+                self.sync.mark('enqueue', contract_ids)
+        finally:
             os.environ["EMPOWERING_URL"] = self.emp_client.engine.url
+            # The sync job wrote new etags
+            self.erp_reader.invalidate(contract_ids)
 
+        new_contracts = []
+        for contract in contracts:
             try:
-                new_contracts.append(self.emp_client.get_contract(contract['name']))
+                new_contracts.append(self.sync.wait_for(self.emp_client, contract['id'], contract['name']))
             except Exception, e:
                 self.fail('Contract was not created')
         return new_contracts
@@ -80,15 +115,14 @@ class EmpoweringTestContract(unittest.TestCase):
         for new_contract in new_contracts:
             contract_filename = os.path.join('data', 'contracts',
                                              '{contractId}.json'.format(**{'contractId': new_contract['contractId']}))
-            contract_filename_diff = os.path.join('contracts',
-                                                  '{contractId}.diff'.format(**{'contractId': new_contract['contractId']}))
+            contract_filename_delta = os.path.join('data', 'contracts',
+                                                   '{contractId}.delta.json'.format(**{'contractId': new_contract['contractId']}))
             contract = uempowering.EmpoweringContract()
             contract.load_from_file(contract_filename)
-            remove_from_dictionary(new_contract, ['_id', '_etag', '_created', '_updated', '_version', '_links'])
 
-            new_diff = str(diff(byteify(new_contract), contract.root))
-            test_diff = open(os.path.join('data', contract_filename_diff)).read()
-            self.assertEqual(new_diff, test_diff[:-1])
+            new_delta = diff_trees(new_contract, contract.root)
+            test_delta = load_delta(contract_filename_delta)
+            self.assertEqual(new_delta, test_delta)
 
     @unittest.skip('No unittest contract in ERP database')
     def test_new_2(self):
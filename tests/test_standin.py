@@ -0,0 +1,235 @@
+import os
+import json
+import datetime
+import tempfile
+import unittest
+import requests
+from requests.adapters import HTTPAdapter
+
+from standin import EmpoweringStandIn
+from contract_cache import ContractCache
+from cassette import DATE_FORMAT, body_hash
+from session import EmpoweringSession, install_session, uninstall_session
+from pager import ContractPager
+from cleanup import CleanupQueue
+from utils import ContractNamespace
+
+import uempowering
+
+
+class EmpoweringTestStandIn(unittest.TestCase):
+    server = None
+
+    @classmethod
+    def setUpClass(self):
+        self.server = EmpoweringStandIn().start()
+
+    @classmethod
+    def tearDownClass(self):
+        self.server.stop()
+
+    def setUp(self):
+        self.server.store.clear()
+        with open(os.path.join('data', 'test_new_contract1.json')) as f:
+            self.contract = json.load(f)
+
+    def _url(self, contract_id=''):
+        return '{0}/contracts/{1}'.format(self.server.url, contract_id)
+
+    def _post(self, contract):
+        return requests.post(self._url(), data=json.dumps(contract),
+                             headers={'Content-Type': 'application/json'})
+
+    def test_post_1(self):
+        """ Post new contract with all data
+        """
+        response = self._post(self.contract)
+        self.assertEqual(response.status_code, 201)
+        result = response.json()
+        self.assertEqual(result['_status'], 'OK')
+        self.assertEqual(result['contractId'], self.contract['contractId'])
+
+        contract = requests.get(self._url(result['contractId'])).json()
+        for field in ['_id', '_etag', '_created', '_updated', '_version', '_links']:
+            contract.pop(field)
+        self.assertEqual(contract, self.contract)
+
+    def test_post_2(self):
+        """ Post new contract with data missing: meteringPointId
+        """
+        self.contract.pop('meteringPointId')
+        response = self._post(self.contract)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.reason, 'UNPROCESSABLE ENTITY')
+        self.assertEqual(response.json()['_status'], 'ERR')
+        self.assertDictEqual(response.json()['_issues'],
+                             {'meteringPointId': 'required field'})
+
+    def test_post_3(self):
+        """ Post duplicated contractId
+        """
+        self._post(self.contract)
+        response = self._post(self.contract)
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('contractId', response.json()['_issues'])
+
+    def test_post_4(self):
+        """ Post new contract with wrong data: fake citycode
+        """
+        self.contract['customer']['address']['cityCode'] = '9999999999'
+        response = self._post(self.contract)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['_issues'].keys(), ['cityCode'])
+
+    def test_get_1(self):
+        """ Get unknown contract
+        """
+        response = requests.get(self._url('AXXXXXXXXX'))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.reason, 'NOT FOUND')
+
+    def test_update_1(self):
+        """ Patch contract with its _etag
+        """
+        etag = self._post(self.contract).json()['_etag']
+        response = requests.patch(self._url(self.contract['contractId']),
+                                  data=json.dumps({'power': 11000}),
+                                  headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.json()['_etag'], etag)
+        self.assertEqual(response.json()['power'], 11000)
+
+    def test_delete_1(self):
+        """ Delete wrong _etag
+        """
+        self._post(self.contract)
+        response = requests.delete(self._url(self.contract['contractId']),
+                                   headers={'If-Match': 'XXXXXXXXXXXXXX'})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.reason, 'PRECONDITION FAILED')
+
+    def test_delete_2(self):
+        """ Delete contract
+        """
+        etag = self._post(self.contract).json()['_etag']
+        response = requests.delete(self._url(self.contract['contractId']),
+                                   headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 204)
+        response = requests.get(self._url(self.contract['contractId']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cache_1(self):
+        """ Repeated gets are answered with 304 from the cache until an update
+        """
+        cache = ContractCache(HTTPAdapter())
+        session = requests.Session()
+        session.mount('http://', cache)
+        etag = self._post(self.contract).json()['_etag']
+        url = self._url(self.contract['contractId'])
+        first = session.get(url).json()
+        self.assertEqual(session.get(url).json(), first)
+        self.assertEqual((cache.stats()['misses'], cache.stats()['hits']), (1, 1))
+
+        session.patch(url, data=json.dumps({'power': 11000}), headers={'If-Match': etag})
+        self.assertEqual(session.get(url).json()['power'], 11000)
+        self.assertEqual(cache.stats()['invalidations'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_cache_2(self):
+        """ Least recently used contracts are evicted to fit the byte budget
+        """
+        ids = ['A1', 'A2', 'A3']
+        for contract_id in ids:
+            self._post(dict(self.contract, contractId=contract_id))
+        size = len(requests.get(self._url('A1')).content)
+        cache = ContractCache(HTTPAdapter(), max_bytes=size * 2)
+        session = requests.Session()
+        session.mount('http://', cache)
+        for contract_id in ids + ['A3', 'A1']:
+            session.get(self._url(contract_id))
+        self.assertEqual(cache.entries.keys(), ['A3', 'A1'])
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_pager_1(self):
+        """ Contracts are listed page by page, projected, and resumed from a checkpoint
+        """
+        ids = ['P{0:02d}'.format(n) for n in reversed(range(25))]
+        for contract_id in ids:
+            self._post(dict(self.contract, contractId=contract_id))
+        session = EmpoweringSession(self.server.url)
+        pager = ContractPager(session, page_size=10, projection={'contractId': 1})
+        contracts = list(pager)
+        self.assertEqual([contract['contractId'] for contract in contracts], sorted(ids))
+        self.assertEqual(set(contracts[0]), set(['contractId', '_id', '_etag', '_created', '_updated']))
+        self.assertEqual((pager.pages, pager.total, pager.checkpoint), (3, 25, None))
+
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+        pager = ContractPager(session, page_size=10, checkpoint_file=checkpoint)
+        for n, contract in zip(range(15), pager):
+            pass
+        resumed = ContractPager(session, page_size=10, checkpoint_file=checkpoint)
+        self.assertEqual([contract['contractId'] for contract in resumed], sorted(ids)[10:])
+        self.assertFalse(os.path.exists(checkpoint))
+        os.rmdir(os.path.dirname(checkpoint))
+
+    def test_cleanup_1(self):
+        """ The final sweep retries leaked contracts and deletes the namespace's leftovers
+        """
+        namespace = ContractNamespace(worker='S', run='W')
+        ids = [namespace.next_id() for _ in range(3)]
+        for contract_id in ids + ['TSWX-0001', 'TSV-0001']:
+            self._post(dict(self.contract, contractId=contract_id))
+        client = uempowering.Empowering({'url': self.server.url}, debug=False)
+        cleanup = CleanupQueue(client, workers=2, namespace=namespace,
+                               session=EmpoweringSession(self.server.url))
+        cleanup.leaked.append(ids[0])
+
+        report = cleanup.sweep()
+        self.assertEqual((report['retried'], report['leftovers']), (1, 2))
+        self.assertEqual((report['deleted'], report['leaked']), (3, 0))
+        self.assertEqual(sorted(self.server.store.documents), ['TSV-0001', 'TSWX-0001'])
+        workers = cleanup.workers
+        cleanup.close()
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+
+    def test_session_1(self):
+        """ Only requests to the Empowering URL go through the installed session
+        """
+        session = EmpoweringSession(self.server.url + '/empowering')
+        sent = []
+
+        class Recorder(HTTPAdapter):
+            def send(self, request, **kwargs):
+                sent.append(request.url)
+                return HTTPAdapter.send(self, request, **kwargs)
+        session.mount('http://', Recorder())
+        original = requests.request
+        install_session(session)
+        try:
+            requests.get(self.server.url + '/empowering/contracts/')
+            self.assertEqual(self._post(self.contract).status_code, 201)
+        finally:
+            uninstall_session()
+        self.assertEqual(sent, [self.server.url + '/empowering/contracts/'])
+        self.assertIs(requests.request, original)
+        self.assertIs(requests.api.request, original)
+
+    def test_cassette_1(self):
+        """ Dates relative to the run hash alike on any day, fixed dates don't
+        """
+        recorded = datetime.datetime(2026, 1, 1, 9, 30)
+        replayed = recorded + datetime.timedelta(days=40, hours=5)
+
+        def body(now, days):
+            return json.dumps(dict(self.contract, dateStart=(
+                now + datetime.timedelta(days=days)).strftime(DATE_FORMAT)))
+        self.assertEqual(body_hash(body(recorded, 15), recorded),
+                         body_hash(body(replayed, 15), replayed))
+        self.assertNotEqual(body_hash(body(recorded, 15), recorded),
+                            body_hash(body(recorded, 0), recorded))
+        fixture = json.dumps(self.contract)
+        self.assertNotEqual(body_hash(fixture, recorded),
+                            body_hash(fixture.replace('2014-01-01', '2014-01-02'), recorded))
+
+if __name__ == '__main__':
+    unittest.main()
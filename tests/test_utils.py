@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import os
+import csv
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from utils import byteify, byteify_loads, iter_list_from_file, read_list_from_file, setup_pg
+from querylog import normalize_statement
+from fixtures import FixtureCache
+from profiling import TestProfiler
+
+
+class EmpoweringTestUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_byteify_1(self):
+        """ Unicode keys and values are utf-8 encoded at every depth
+        """
+        tree = json.loads(json.dumps({'a': [u'x', {'b': u'Lleidà', 'c': [1, [u'y']]}],
+                                      'n': None, 'e': {}, 'l': []}))
+        result = byteify(tree)
+        self.assertEqual(result, {'a': ['x', {'b': 'Lleid\xc3\xa0', 'c': [1, ['y']]}],
+                                  'n': None, 'e': {}, 'l': []})
+        self.assertTrue(all(isinstance(key, str) for key in result))
+        self.assertTrue(isinstance(tree.keys()[0], unicode))
+
+    def test_byteify_2(self):
+        """ Subtrees without unicode are not copied
+        """
+        address = {'city': 'Girona'}
+        tree = {u'customer': {'address': address}, 'devices': [{'deviceId': 'x'}]}
+        result = byteify(tree)
+        self.assertIsNot(result, tree)
+        self.assertIs(result['customer']['address'], address)
+        self.assertIs(result['devices'], tree['devices'])
+        self.assertIs(byteify(address), address)
+
+    def test_byteify_3(self):
+        """ Encoding while parsing matches parsing then encoding
+        """
+        content = json.dumps({'a': [u'x', {'b': u'Lleidà', 'c': [[u'y']]}], 'n': None})
+        self.assertEqual(byteify_loads(content), byteify(json.loads(content)))
+        self.assertEqual(byteify_loads('[["a"], "b"]'), [['a'], 'b'])
+
+    def test_imports_1(self):
+        """ The helpers import without the Empowering client or psycopg2
+        """
+        script = ("import sys; import utils; "
+                  "sys.exit(any(name.split('.')[0] in ('uempowering', 'requests', 'psycopg2')"
+                  " for name in sys.modules))")
+        self.assertEqual(subprocess.call([sys.executable, '-c', script],
+                                         cwd=os.path.dirname(os.path.abspath(__file__))), 0)
+
+    def _write_ids(self, content):
+        filename = os.path.join(self.tmpdir, 'ids.csv')
+        with open(filename, 'wb') as f:
+            f.write(content)
+        return filename
+
+    def test_ids_1(self):
+        """ IDs are read lazily, de-duplicated and chunked
+        """
+        filename = self._write_ids('3,a\n1\n\n"2",b\n3\n4\n')
+        self.assertEqual(read_list_from_file(filename, int), [3, 1, 2, 3, 4])
+        self.assertEqual(list(iter_list_from_file(filename, int)), [3, 1, 2, 4])
+        self.assertEqual(list(iter_list_from_file(filename, int, chunk_size=3)), [[3, 1, 2], [4]])
+        self.assertEqual(list(iter_list_from_file(self._write_ids(''), int)), [])
+
+    def test_ids_2(self):
+        """ Shards are disjoint, complete and independent of file order
+        """
+        ids = range(1000)
+        filename = self._write_ids(''.join('{0}\n'.format(i) for i in ids))
+        shards = [list(iter_list_from_file(filename, int, shard=(k, 4))) for k in range(4)]
+        self.assertEqual(sorted(sum(shards, [])), ids)
+        self.assertTrue(all(shards))
+
+        filename = self._write_ids(''.join('{0}\n'.format(i) for i in reversed(ids)))
+        self.assertEqual(sorted(iter_list_from_file(filename, int, shard=(1, 4))), sorted(shards[1]))
+
+    def test_ids_3(self):
+        """ Values are read as the csv module reads them, blank lines skipped
+        """
+        content = ' 3 ,a\r\n\r\n,b\n"x\ny",c\n"q""uoted"\nlast'
+        filename = self._write_ids(content)
+        with open(filename, 'rb') as f:
+            expected = [row[0] for row in csv.reader(f) if row]
+        self.assertEqual(expected, [' 3 ', '', 'x\ny', 'q"uoted', 'last'])
+        self.assertEqual(list(iter_list_from_file(filename, str, unique=False)), expected)
+
+    def test_statement_1(self):
+        """ Statements are normalized without literals and with collapsed VALUES lists
+        """
+        self.assertEqual(normalize_statement("SELECT etag FROM giscedata_polissa\n  WHERE id=12 AND name = 'o''k'"),
+                         "SELECT etag FROM giscedata_polissa WHERE id=? AND name = ?")
+        self.assertEqual(normalize_statement("UPDATE t SET value_0 = v.value_0 FROM (VALUES "
+                                             "(1, 'a'::character varying(64)), (2, 'b'::character varying(64))) AS v"),
+                         "UPDATE t SET value_0 = v.value_0 FROM (VALUES "
+                         "(?, ?::character varying(?)), ...) AS v")
+
+    @unittest.skipUnless(os.getenv('DB_HOSTNAME'), 'needs a PostgreSQL database')
+    def test_isolated_1(self):
+        """ Savepoint isolation rolls back its changes and the transaction it opened
+        """
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+        pg = setup_pg()
+        pg.table = 'pg_isolated_test'
+        pg.update('CREATE TABLE pg_isolated_test (id integer PRIMARY KEY, name varchar(16))')
+        try:
+            pg.update("INSERT INTO pg_isolated_test VALUES (1, 'a')")
+            with pg.isolated([1], ['name'], savepoint=True):
+                pg.update_record(1, 'name', 'b')
+                self.assertEqual(pg.select('SELECT name FROM pg_isolated_test'), ['b'])
+            self.assertEqual(pg.conn.get_transaction_status(), TRANSACTION_STATUS_IDLE)
+            self.assertEqual(pg.select('SELECT name FROM pg_isolated_test'), ['a'])
+
+            # A transaction the caller opened is left open
+            with pg.isolated([1], ['name'], savepoint=True):
+                pg.update_records([(1, 'name', 'c')])
+            self.assertEqual(pg.conn.get_transaction_status(), TRANSACTION_STATUS_INTRANS)
+            self.assertEqual(pg.select('SELECT name FROM pg_isolated_test'), ['a'])
+        finally:
+            pg.conn.rollback()
+            pg.update('DROP TABLE pg_isolated_test')
+
+    def test_fixtures_1(self):
+        """ Fixtures are parsed once, handed out as private copies and reparsed when changed
+        """
+        filename = os.path.join(self.tmpdir, 'contract.json')
+        with open(filename, 'w') as f:
+            json.dump({'contractId': 'A', 'tariffId': '2.0A'}, f)
+        fixtures = FixtureCache(self.tmpdir)
+        first = fixtures.tree('contract.json')
+        first['contractId'] = 'B'
+        self.assertEqual(fixtures.tree('contract.json')['contractId'], 'A')
+        self.assertEqual((fixtures.misses, fixtures.hits), (1, 1))
+
+        with open(filename, 'w') as f:
+            json.dump({'contractId': 'A', 'tariffId': '3.0A'}, f)
+        self.assertEqual(fixtures.tree('contract.json')['tariffId'], '3.0A')
+        self.assertEqual(fixtures.misses, 2)
+
+    def test_profile_1(self):
+        """ Phases are timed without their nested phases and written per test
+        """
+        profiler = TestProfiler('sample', self.tmpdir, interval=0.001)
+        profiler.start('test_utils.test_profile_1')
+        with profiler.phase('http'):
+            time.sleep(0.01)
+            with profiler.phase('diff'):
+                time.sleep(0.1)
+        profiler.stop()
+        phases = profiler.total_phases
+        self.assertTrue(phases['diff'] >= 0.1)
+        # Inclusive timing would put http above diff
+        self.assertTrue(0.01 <= phases['http'] < phases['diff'])
+        with open(os.path.join(self.tmpdir, 'test_utils.test_profile_1.collapsed')) as f:
+            stacks = f.read()
+        self.assertIn('[diff];', stacks)
+        self.assertIn('test_utils.py:test_profile_1', stacks)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,75 +1,437 @@
 import os
 import csv
-import psycopg2
-import datetime
+import json
+import math
+import mmap
+import zlib
+import uuid
+import time
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+from profiling import profiled
+
+__EMPOWERING = None
+__NAMESPACE = None
+
+def _byteify_frame(node):
+    # [node, items, key being visited, copy or None, is_dict]. JSON objects
+    # have either all unicode keys or none, the former are rebuilt eagerly.
+    if isinstance(node, dict):
+        eager = isinstance(next(iter(node)), unicode)
+        return [node, node.iteritems(), None, {} if eager else None, True]
+    return [node, enumerate(node), None, None, False]
+
+
+def _byteify_store(frame, key, value):
+    copy = frame[3]
+    if copy is None:
+        copy = frame[3] = dict(frame[0]) if frame[4] else list(frame[0])
+    if frame[4] and isinstance(key, unicode):
+        copy.pop(key, None)
+        key = key.encode('utf-8')
+    copy[key] = value
+
 
 def byteify(input):
-    if isinstance(input, dict):
-        return {byteify(key):byteify(value) for key,value in input.iteritems()}
-    elif isinstance(input, list):
-        return [byteify(element) for element in input]
-    elif isinstance(input, unicode):
+    """utf-8 encode the unicode keys and values of a JSON tree
+
+    Walks the tree with an explicit stack. Containers are only copied when
+    something inside them changes, untouched subtrees are returned as is.
+    """
+    if isinstance(input, unicode):
         return input.encode('utf-8')
-    else:
+    if not isinstance(input, (dict, list)) or not input:
         return input
 
+    stack = [_byteify_frame(input)]
+    while stack:
+        frame = stack[-1]
+        items, is_dict = frame[1], frame[4]
+        for key, value in items:
+            if isinstance(value, unicode):
+                new_value = value.encode('utf-8')
+            elif isinstance(value, (dict, list)) and value:
+                frame[2] = key
+                stack.append(_byteify_frame(value))
+                break
+            else:
+                new_value = value
+            if frame[3] is not None or new_value is not value or \
+                    (is_dict and isinstance(key, unicode)):
+                _byteify_store(frame, key, new_value)
+        else:
+            stack.pop()
+            node = frame[0] if frame[3] is None else frame[3]
+            if not stack:
+                return node
+            parent = stack[-1]
+            if parent[3] is not None or node is not frame[0] or \
+                    (parent[4] and isinstance(parent[2], unicode)):
+                _byteify_store(parent, parent[2], node)
+
+
+def _byteify_list(values):
+    return [value.encode('utf-8') if isinstance(value, unicode) else
+            _byteify_list(value) if isinstance(value, list) else value
+            for value in values]
+
+
+def _byteify_pairs(pairs):
+    return dict((key.encode('utf-8'),
+                 value.encode('utf-8') if isinstance(value, unicode) else
+                 _byteify_list(value) if isinstance(value, list) else value)
+                for key, value in pairs)
+
+
+def _byteify_top(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return _byteify_list(value)
+    return value
+
+
+def byteify_loads(content):
+    """json.loads returning utf-8 str instead of unicode, encoded while parsing
+    """
+    return _byteify_top(json.loads(content, object_pairs_hook=_byteify_pairs))
+
+
+def byteify_load(fp):
+    return _byteify_top(json.load(fp, object_pairs_hook=_byteify_pairs))
+
 
 def remove_from_dictionary(_dict, _keys):
     for _key in _keys:
         _dict.pop(_key)
 
 
+def rename_contract(root, contract_id):
+    # ids read back from the API are unicode, uuid5 needs bytes
+    contract_id = str(contract_id)
+    root['contractId'] = contract_id
+    root['meteringPointId'] = str(uuid.uuid5(uuid.NAMESPACE_URL, contract_id + '/meteringPoint'))
+    for n, device in enumerate(root.get('devices') or []):
+        device['deviceId'] = str(uuid.uuid5(uuid.NAMESPACE_URL,
+                                            '{0}/device/{1}'.format(contract_id, n)))
+    return root
+
+
+class ContractNamespace(object):
+    """contractIds unique to one test worker and run
+
+    The prefix combines the pytest-xdist worker (or the pid) with the start
+    time, so parallel workers and leftovers of earlier runs never collide.
+    A fixed `run` replaces the start time, for runs that must repeat the
+    same contractIds.
+    """
+    def __init__(self, prefix='T', worker=None, run=None):
+        worker = worker or os.getenv('PYTEST_XDIST_WORKER') or str(os.getpid())
+        run = run or '{0:x}'.format(int(time.time()) & 0xffffff)
+        self.prefix = '{0}{1}{2}'.format(prefix, worker.upper(), run)
+        self.counter = itertools.count(1)
+
+    def next_id(self):
+        return '{0}-{1:04d}'.format(self.prefix, next(self.counter))
+
+    def rename(self, root, contract_id=None):
+        return rename_contract(root, contract_id or self.next_id())
+
+    def __contains__(self, contract_id):
+        return str(contract_id).startswith(self.prefix + '-')
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    result = {'p{0}'.format(point): samples[max(0, int(math.ceil(len(samples) * point / 100.0)) - 1)]
+              for point in points}
+    result['max'] = samples[-1]
+    result['mean'] = sum(samples) / float(len(samples))
+    return result
+
+
 def read_list_from_file(filename, cast_type):
     if filename:
-        with open(filename, 'rb') as f:
-            return [cast_type(row[0]) for row in csv.reader(f)]
+        return list(iter_list_from_file(filename, cast_type, unique=False))
     else:
         return None
 
 
+def _first_columns(f):
+    try:
+        lines = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty files can't be mapped
+        return
+    try:
+        source = iter(lines.readline, '')
+        for line in source:
+            if '"' in line:
+                # The csv reader pulls the next lines of a multiline field
+                row = next(csv.reader(itertools.chain([line], source)), None)
+            else:
+                row = line.rstrip('\r\n').split(',', 1) if line.strip('\r\n') else []
+            if row:
+                yield row[0]
+    finally:
+        lines.close()
+
+
+def shard_from_env(var='TEST_SHARD'):
+    """(worker, workers) from a K/M environment variable, None when unset
+    """
+    value = os.getenv(var)
+    if not value:
+        return None
+    worker, workers = [int(part) for part in value.split('/')]
+    return worker, workers
+
+
+def iter_list_from_file(filename, cast_type, chunk_size=None, shard=None, unique=True):
+    """Lazily yield the first column of an ID file
+
+    The file is scanned through mmap, only quoted lines go through the csv
+    module; values are read as csv.reader does and blank lines are skipped.
+    With `shard` = (worker, workers) an ID belongs to worker
+    crc32(id) % workers, a stable split that doesn't depend on file order.
+    With `chunk_size` lists of up to that many IDs are yielded instead.
+    `unique` drops repeated IDs by keeping every ID yielded in a set, so
+    memory grows with the distinct IDs of the shard; pass unique=False to
+    stream a file of any size in constant memory.
+    """
+    seen = set()
+    chunk = []
+    with open(filename, 'rb') as f:
+        for value in _first_columns(f):
+            value = cast_type(value)
+            if shard and (zlib.crc32(str(value)) & 0xffffffff) % shard[1] != shard[0]:
+                continue
+            if unique:
+                if value in seen:
+                    continue
+                seen.add(value)
+            if not chunk_size:
+                yield value
+                continue
+            chunk.append(value)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
 class PgClient(object):
     conn = None
     cr = None
+    pool = None
+    table = 'giscedata_polissa'
+    savepoint = None
+    snapshots = 0
+    cursors = 0
 
     def __init__(self, config):
+            from psycopg2.pool import ThreadedConnectionPool
+            from querylog import QueryLog
+
             pg_con = " host=" + config.get('DB_HOSTNAME') + \
                      " port=" + config.get('DB_PORT') + \
                      " dbname=" + config.get('DB_NAME') + \
                      " user=" + config.get('DB_USER') + \
                      " password=" + config.get('DB_PASSWORD')
-            self.conn = psycopg2.connect(pg_con)
+            slow_ms = config.get('PG_SLOW_MS')
+            self.log = QueryLog(float(slow_ms) if slow_ms else None, bool(config.get('PG_EXPLAIN')))
+            self.pool = ThreadedConnectionPool(1, int(config.get('DB_POOL_SIZE') or 4), pg_con,
+                                               cursor_factory=self.log.cursor_factory())
+            self.conn = self.pool.getconn()
             self.cr = self.conn.cursor()
+            self.column_types = {}
+            self.prepared = set()
 
-    def query(self, query):
+    @contextmanager
+    def connection(self):
+        if self.savepoint:
+            yield self.conn
+            return
+        conn = self.pool.getconn()
         try:
-            self.cr.execute(query)
-        except Exception, ex:
-            print 'Failed executing query'
-            raise ex
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
 
-    def select(self, query):
-        self.query(query)
+    def query(self, query, params=None):
+        # Failures are reported by the query log
+        self.cr.execute(query, params)
+
+    def select(self, query, params=None):
+        self.query(query, params)
         return [record[0] for record in self.cr.fetchall()]
 
-    def update(self, query):
-        self.query(query)
-        self.conn.commit()
+    def update(self, query, params=None):
+        self.query(query, params)
+        if not self.savepoint:
+            self.conn.commit()
+
+    def _prepare(self, name, statement, types):
+        """PREPARE `statement` once on the shared connection
+        """
+        if name not in self.prepared:
+            self.query('PREPARE {0} ({1}) AS {2}'.format(name, ', '.join(types), statement))
+            self.prepared.add(name)
 
+    @profiled('pg_update')
     def update_record(self, contract_id, field, new_value):
         if not new_value:
-            new_value = 'NULL'
-        else:
-            if isinstance(new_value, datetime.datetime):
-                new_value = str(new_value)
-            if isinstance(new_value,str) or isinstance(new_value,unicode):
-                new_value = "'{new_value}'".format(**locals())
-
-        sql_query = "SELECT {field} FROM giscedata_polissa WHERE id={contract_id}".format(**locals())
-        old_value = self.select(sql_query)[0]
-        sql_query = "UPDATE giscedata_polissa SET {field}={new_value} WHERE id={contract_id}".format(**locals())
-        self.update(sql_query)
+            new_value = None
+        _type = self._column_types(self.cr, [field])[0]
+        table = self.table
+        name = 'pg_update_record_{0}'.format(field)
+        self._prepare(name + '_old', 'SELECT "{field}" FROM {table} WHERE id = $1'.format(**locals()),
+                      ['integer'])
+        self._prepare(name, 'UPDATE {table} SET "{field}" = $2 WHERE id = $1'.format(**locals()),
+                      ['integer', _type])
+        old_value = self.select('EXECUTE {0}_old (%s)'.format(name), (contract_id,))[0]
+        self.update('EXECUTE {0} (%s, %s)'.format(name), (contract_id, new_value))
         return old_value
 
+    def _column_types(self, cr, fields):
+        missing = [field for field in fields if field not in self.column_types]
+        if missing:
+            cr.execute("SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+                       "WHERE attrelid = %s::regclass AND attname = ANY(%s) AND NOT attisdropped",
+                       (self.table, missing))
+            self.column_types.update(cr.fetchall())
+        unknown = [field for field in fields if field not in self.column_types]
+        if unknown:
+            raise Exception('Unknown {0} fields: {1}'.format(self.table, ', '.join(unknown)))
+        return [self.column_types[field] for field in fields]
+
+    @profiled('pg_update')
+    def update_records(self, records):
+        """Apply many (contract_id, field, value) tuples in a single UPDATE
+
+        Returns the (contract_id, field, old_value) tuples of the rows found,
+        ready to be handed back to restore_records.
+        """
+        rows = OrderedDict()
+        fields = []
+        for contract_id, field, value in records:
+            if field not in fields:
+                fields.append(field)
+            rows.setdefault(contract_id, {})[field] = value
+        if not rows:
+            return []
+
+        with self.connection() as conn:
+            cr = conn.cursor()
+            types = self._column_types(cr, fields)
+            row_template = '(%s' + ''.join(', %s::boolean, %s::' + _type for _type in types) + ')'
+            values = []
+            for contract_id, changes in rows.iteritems():
+                params = [contract_id]
+                for field in fields:
+                    params += [field in changes, changes.get(field)]
+                values.append(cr.mogrify(row_template, params))
+
+            columns = ', '.join('set_{0}, value_{0}'.format(i) for i in range(len(fields)))
+            assignments = ', '.join(
+                '"{field}" = CASE WHEN v.set_{i} THEN v.value_{i} ELSE p."{field}" END'.format(**locals())
+                for i, field in enumerate(fields))
+            old_columns = ', '.join('old."{0}"'.format(field) for field in fields)
+            table = self.table
+            values = ', '.join(values)
+            cr.execute("UPDATE {table} AS p SET {assignments} "
+                       "FROM (VALUES {values}) AS v(id, {columns}), {table} AS old "
+                       "WHERE p.id = v.id AND old.id = v.id "
+                       "RETURNING p.id, {old_columns}".format(**locals()))
+            old_values = dict((row[0], row[1:]) for row in cr.fetchall())
+
+        return [(contract_id, field, old_values[contract_id][fields.index(field)])
+                for contract_id, changes in rows.iteritems() if contract_id in old_values
+                for field in changes]
+
+    def restore_records(self, snapshot):
+        self.update_records(snapshot)
+
+    def stream(self, query, params=None, itersize=5000):
+        """Rows of `query` read through a server side cursor, `itersize` at a time
+        """
+        PgClient.cursors += 1
+        with self.connection() as conn:
+            cr = conn.cursor(name='pg_stream_{0}'.format(PgClient.cursors))
+            cr.itersize = itersize
+            try:
+                cr.execute(query, params)
+                for row in cr:
+                    yield row
+            finally:
+                cr.close()
+
+    @contextmanager
+    def isolated(self, contract_ids, fields, keep=(), savepoint=False):
+        """Snapshot `fields` of `contract_ids` and put them back on exit
+
+        The rows are copied into a temp table of a pinned connection and
+        restored with a single UPDATE, also when the block fails. Fields in
+        `keep` are only restored on failure. With `savepoint` every change
+        runs on the shared connection and is rolled back instead, which only
+        works when whoever reads the rows shares that connection too. The
+        transaction around the savepoint is rolled back as well, unless the
+        caller had already opened it.
+        """
+        if savepoint:
+            from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+            opened = self.conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+            self.query('SAVEPOINT pg_isolated')
+            self.savepoint = 'pg_isolated'
+            try:
+                yield self
+            finally:
+                self.savepoint = None
+                if opened:
+                    self.conn.rollback()
+                else:
+                    self.query('ROLLBACK TO SAVEPOINT pg_isolated')
+                    self.query('RELEASE SAVEPOINT pg_isolated')
+            return
+
+        PgClient.snapshots += 1
+        snapshot = 'pg_isolated_{0}'.format(PgClient.snapshots)
+        table = self.table
+        conn = self.pool.getconn()
+        try:
+            cr = conn.cursor()
+            self._column_types(cr, fields)
+            columns = ', '.join('"{0}"'.format(field) for field in fields)
+            cr.execute("CREATE TEMP TABLE {snapshot} AS SELECT id, {columns} FROM {table} "
+                       "WHERE id = ANY(%s)".format(**locals()), (list(contract_ids),))
+            conn.commit()
+            failed = True
+            try:
+                yield self
+                failed = False
+            finally:
+                restore = [field for field in fields if failed or field not in keep]
+                if restore:
+                    assignments = ', '.join('"{0}" = s."{0}"'.format(field) for field in restore)
+                    cr.execute("UPDATE {table} AS p SET {assignments} FROM {snapshot} AS s "
+                               "WHERE p.id = s.id".format(**locals()))
+                cr.execute("DROP TABLE {snapshot}".format(**locals()))
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
 
 def setup_pg():
     pg_vars = ['DB_HOSTNAME', 'DB_PORT', 'DB_NAME', 'DB_USER', 'DB_PASSWORD']
@@ -81,5 +443,44 @@ def setup_pg():
         return value
 
     config = {var: get_env(var) for var in pg_vars}
+    for var in ['DB_POOL_SIZE', 'PG_SLOW_MS', 'PG_EXPLAIN']:
+        config[var] = os.getenv(var, None)
     return PgClient(config)
 
+
+def setup_empowering():
+    """The Empowering client of the run. The client stack is imported here,
+    so the helpers above don't need it
+    """
+    global __EMPOWERING
+    if __EMPOWERING:
+        return __EMPOWERING
+
+    import uempowering
+    from session import setup_session
+
+    config = {
+        'url': os.getenv('EMPOWERING_URL', None),
+        'key': os.getenv('EMPOWERING_KEY_FILE', None),
+        'cert': os.getenv('EMPOWERING_CERT_FILE', None),
+        'company_id': os.getenv('EMPOWERING_COMPANY_ID', None)
+        }
+    if os.getenv('EMPOWERING_STANDIN'):
+        from standin import setup_standin
+        config['url'] = setup_standin().url
+        os.environ['EMPOWERING_URL'] = config['url']
+    setup_session(config)
+    __EMPOWERING = uempowering.Empowering(config, debug=False)
+    return __EMPOWERING
+
+
+def setup_namespace():
+    global __NAMESPACE
+    if not __NAMESPACE:
+        if os.getenv('EMPOWERING_CASSETTE'):
+            # Cassettes are keyed by request body, contractIds included
+            __NAMESPACE = ContractNamespace(worker=os.getenv('PYTEST_XDIST_WORKER', 'R'),
+                                            run='C')
+        else:
+            __NAMESPACE = ContractNamespace()
+    return __NAMESPACE